@@ -0,0 +1,262 @@
+import os
+import sys
+import gzip
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import numpy as np
+
+from src.benchmark.synthetic import generate_corpus, generate_multistream_dump, build_tiny_model, \
+    synthetic_grounding, synthetic_annotations
+from src.common.time_expressions import load_time_expressions, expression_labels
+from src.extractive.corpus import open_corpus, read_stream_ranges
+from src.extractive.find_time_expressions_in_wiki import find_time_expressions
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--langs", default="en,de,ja,hi", type=str, required=False,
+                        help="Comma-separated language codes")
+    parser.add_argument("--num_lines", default=100000, type=int, required=False, help="Lines in each synthetic corpus")
+    parser.add_argument("--repeats", default=3, type=int, required=False, help="Number of runs of each benchmark")
+    parser.add_argument("--work_dir", default=None, type=str, required=False,
+                        help="Directory for the synthetic corpora and model. A temporary directory by default")
+    parser.add_argument("--baseline", default="output/benchmark/baseline.json", type=str, required=False,
+                        help="Baseline results to compare to")
+    parser.add_argument("--save_baseline", action="store_true", help="Save the results as the new baseline")
+    parser.add_argument("--threshold", default=0.2, type=float, required=False,
+                        help="Flag benchmarks slower than the baseline by more than this ratio")
+    args = parser.parse_args()
+
+    langs = args.langs.split(",")
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix="time_expressions_benchmark_")
+    os.makedirs(work_dir, exist_ok=True)
+
+    # Create the synthetic data
+    for lang in langs:
+        corpus_file = f"{work_dir}/{lang}_wiki.tar.gz"
+        if not os.path.exists(corpus_file):
+            generate_corpus(lang, corpus_file, num_lines=args.num_lines)
+
+        # Uncompressed copy for the memory-mapped mode
+        if not os.path.exists(f"{work_dir}/{lang}_wiki.txt"):
+            with gzip.open(corpus_file, "rb") as f_in, open(f"{work_dir}/{lang}_wiki.txt", "wb") as f_out:
+                shutil.copyfileobj(f_in, f_out)
+
+        # Multistream dump for the bz2 mode
+        if not os.path.exists(f"{work_dir}/{lang}wiki-multistream.xml.bz2"):
+            generate_multistream_dump(corpus_file, f"{work_dir}/{lang}wiki-multistream.xml.bz2")
+
+    model_dir = f"{work_dir}/tiny_bert"
+    if not os.path.exists(f"{model_dir}/config.json"):
+        build_tiny_model(model_dir)
+
+    # The scan modes must agree before they are timed
+    mismatches = []
+    for lang in langs:
+        mismatches.extend(check_find_time_expressions(work_dir, lang))
+
+    mismatches.extend(check_unknown_candidates(model_dir))
+
+    for name in mismatches:
+        print(f"Mismatch in {name}")
+
+    benchmarks = {}
+    for lang in langs:
+        benchmarks[f"find_time_expressions/{lang}"] = bench_find_time_expressions(work_dir, lang)
+        benchmarks[f"find_time_expressions_mmap/{lang}"] = bench_find_time_expressions(work_dir, lang, use_mmap=True)
+        benchmarks[f"find_time_expressions_bz2/{lang}"] = bench_find_time_expressions(work_dir, lang, multistream=True)
+        benchmarks[f"compute_distribution/{lang}"] = bench_compute_distribution(model_dir, lang)
+
+    benchmarks.update(bench_solvers())
+    benchmarks["assign_minutes"] = bench_assign_minutes()
+    benchmarks["correct_am_pm"] = bench_correct_am_pm()
+
+    # Run the benchmarks
+    results = {}
+    for name, fn in benchmarks.items():
+        if fn is None:
+            print(f"{name}: skipped")
+            continue
+
+        results[name] = time_benchmark(fn, args.repeats)
+        print(f"{name}: {results[name]:.4f}s")
+
+    # Compare to the baseline
+    regressions = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f_in:
+            baseline = json.load(f_in)
+
+        regressions = find_regressions(baseline, results, args.threshold)
+        for name, (prev, curr) in regressions.items():
+            print(f"Regression in {name}: {prev:.4f}s -> {curr:.4f}s")
+
+    if args.save_baseline:
+        os.makedirs(os.path.dirname(args.baseline) or ".", exist_ok=True)
+        with open(args.baseline, "w") as f_out:
+            json.dump(results, f_out, indent=2)
+
+    if len(regressions) > 0 or len(mismatches) > 0:
+        sys.exit(1)
+
+
+def time_benchmark(fn, repeats):
+    """
+    Returns the median run time of fn in seconds
+    """
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+
+    return float(np.median(times))
+
+
+def find_regressions(baseline, results, threshold):
+    """
+    Returns the benchmarks that are slower than the baseline by more than threshold
+    """
+    return {name: (baseline[name], curr) for name, curr in results.items()
+            if name in baseline and curr > baseline[name] * (1 + threshold)}
+
+
+def scan_args(work_dir, lang, use_mmap=False, multistream=False):
+    """
+    The corpus file and streams of the synthetic corpus in each scan mode
+    """
+    # The whole dump in a single worker
+    if multistream:
+        corpus_file = f"{work_dir}/{lang}wiki-multistream.xml.bz2"
+        return corpus_file, read_stream_ranges(corpus_file)
+
+    return (f"{work_dir}/{lang}_wiki.txt" if use_mmap else f"{work_dir}/{lang}_wiki.tar.gz"), None
+
+
+def bench_find_time_expressions(work_dir, lang, use_mmap=False, multistream=False):
+    time_expressions, label_map = load_time_expressions(lang)
+    corpus_file, streams = scan_args(work_dir, lang, use_mmap, multistream)
+    return lambda: find_time_expressions(corpus_file, time_expressions, label_map, lang, use_mmap=use_mmap,
+                                         streams=streams)
+
+
+def check_find_time_expressions(work_dir, lang, checkpoint_every=1000):
+    """
+    Checks that the gzip, memory-mapped and bz2 multistream scans of the synthetic corpus
+    have the same counts, and that a scan interrupted halfway and resumed has the same counts
+    as a full scan. Returns the names of the checks that failed.
+    """
+    time_expressions, label_map = load_time_expressions(lang)
+    modes = {"gzip": {}, "mmap": {"use_mmap": True}, "bz2": {"multistream": True}}
+    full_counts, mismatches = None, []
+
+    for mode, kwargs in modes.items():
+        corpus_file, streams = scan_args(work_dir, lang, **kwargs)
+        use_mmap = kwargs.get("use_mmap", False)
+        counts = find_time_expressions(corpus_file, time_expressions, label_map, lang, use_mmap=use_mmap,
+                                       streams=streams)
+
+        # The counts of the other modes are compared to the gzip scan
+        if full_counts is None:
+            full_counts = counts
+        elif not np.array_equal(counts, full_counts):
+            mismatches.append(f"find_time_expressions_{mode}/{lang}")
+
+        # Stop halfway through the corpus, then resume from the checkpoint.
+        # The memory-mapped mode only reads the lines with a clock time.
+        with open_corpus(corpus_file, use_mmap=use_mmap, streams=streams) as corpus:
+            num_lines = sum(1 for _ in corpus)
+
+        with tempfile.TemporaryDirectory() as checkpoint_dir:
+            checkpoint_file = f"{checkpoint_dir}/{lang}_0.json"
+            find_time_expressions(corpus_file, time_expressions, label_map, lang, use_mmap=use_mmap, streams=streams,
+                                  checkpoint_file=checkpoint_file, checkpoint_every=checkpoint_every,
+                                  max_lines=num_lines // 2)
+            resumed_counts = find_time_expressions(
+                corpus_file, time_expressions, label_map, lang, use_mmap=use_mmap, streams=streams,
+                checkpoint_file=checkpoint_file, checkpoint_every=checkpoint_every, resume=True)
+
+        if not np.array_equal(resumed_counts, counts):
+            mismatches.append(f"find_time_expressions_{mode}_resume/{lang}")
+
+    return mismatches
+
+
+def check_unknown_candidates(model_dir):
+    """
+    Checks that a candidate that the tokenizer can't represent gets no probability,
+    and doesn't change the scores of the other candidates. Returns the names of the checks that failed.
+    """
+    from src.lm_based.backend import MaskedLMBackend
+
+    backend = MaskedLMBackend(model_dir)
+    templates = ["The morning starts at [MASK].", "The night ends at [MASK] ."]
+    unknown = "\u2603\u2603"
+
+    scores = backend.score(templates, ["1", "2", unknown])
+    known_scores = backend.score(templates, ["1", "2"])
+    if any(curr[unknown] != 0 or any(abs(curr[c] - known[c]) > 1e-6 for c in known)
+           for curr, known in zip(scores, known_scores)):
+        return ["score_unknown_candidate"]
+
+    return []
+
+
+def bench_compute_distribution(model_dir, lang):
+    from src.lm_based.backend import MaskedLMBackend
+    from src.lm_based.common import compute_distribution, load_language_data, load_templates
+
+    backend = MaskedLMBackend(model_dir)
+    templates = load_templates(lang, "distribution")
+    numbers_map, time_expressions_map, ampm_map = load_language_data(lang)
+
+    # compute_distribution extends the templates list
+    return lambda: compute_distribution(backend, list(templates), numbers_map, time_expressions_map, ampm_map)
+
+
+def bench_solvers():
+    """
+    The solvers require gurobipy, so they are skipped if it is not installed
+    """
+    try:
+        from src import compute_start_end_for_24h_clock, compute_start_end_from_start_end_dist
+    except ImportError:
+        return {"solve_ilp_24h_clock": None, "solve_ilp_start_end": None,
+                "solve_ilp_24h_clock_session": None, "solve_ilp_start_end_session": None}
+
+    expressions = [en for en in expression_labels(load_time_expressions("en")[1]) if en != "before morning"]
+    counts, start_end = synthetic_grounding(expressions)
+
+    # A sweep over groundings with the same expressions, reusing the model
+    groundings = [synthetic_grounding(expressions, seed) for seed in range(5)]
+    clock_session = compute_start_end_for_24h_clock.create_session()
+    start_end_session = compute_start_end_from_start_end_dist.create_session()
+
+    return {"solve_ilp_24h_clock": lambda: compute_start_end_for_24h_clock.solve_ilp(counts, expressions),
+            "solve_ilp_start_end": lambda: compute_start_end_from_start_end_dist.solve_ilp(start_end, expressions),
+            "solve_ilp_24h_clock_session": lambda: [compute_start_end_for_24h_clock.solve_ilp(
+                curr_counts, expressions, clock_session) for curr_counts, _ in groundings],
+            "solve_ilp_start_end_session": lambda: [compute_start_end_from_start_end_dist.solve_ilp(
+                curr_start_end, expressions, start_end_session) for _, curr_start_end in groundings]}
+
+
+def bench_assign_minutes():
+    from src.eval import assign_minutes, exp2id
+
+    dist = {"morning": ("5:00", "11:30"), "noon": ("11:30", "13:00"), "afternoon": ("13:00", "17:45"),
+            "evening": ("17:45", "21:00"), "night": ("21:00", "4:30")}
+    return lambda: assign_minutes(dist, exp2id)
+
+
+def bench_correct_am_pm():
+    from src.human.read_batch_results import correct_am_pm
+
+    annotations = synthetic_annotations()
+    return lambda: correct_am_pm(annotations, "morning", "start")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,146 @@
+import os
+import bz2
+import gzip
+import html
+import json
+import random
+
+from transformers import BertConfig, BertForMaskedLM, BertTokenizer
+
+from src.extractive.corpus import multistream_index
+
+# Time formats that appear in Wikipedia text, including ones that the time regex doesn't match
+TIME_FORMATS = ["{h}:{m:02d}", "{h:02d}:{m:02d}", "{h12}:{m:02d} am", "{h12}:{m:02d} p.m.", "{h}.{m:02d}", "{h}h{m:02d}"]
+
+
+def load_surface_forms(lang):
+    """
+    Returns a list of (English label, surface forms) pairs, with the surface forms as written in the list
+    """
+    time_expressions = [line.strip().split("\t") for line in open(f"data/time_expressions/{lang}.txt")]
+    return [(en, other.split("|")) for en, other in time_expressions]
+
+
+def generate_corpus(lang, out_file, num_lines=100000, time_ratio=0.01, seed=0):
+    """
+    Generates a gzipped Wikipedia-like corpus: filler lines made of template words, of which
+    time_ratio contain a time expression and a clock time.
+    """
+    rnd = random.Random(seed)
+    surface_forms = [exp for _, exps in load_surface_forms(lang) for exp in exps]
+    words = [word for line in open(f"data/templates/distribution/{lang}.txt")
+             for word in line.replace("[MASK]", "").replace("<time_exp>", "").split()]
+    is_asian = lang in {"ja", "zh"}
+    separator = "" if is_asian else " "
+
+    with gzip.open(out_file, "wt", encoding="utf-8") as f_out:
+        for _ in range(num_lines):
+            line = [rnd.choice(words) for _ in range(rnd.randint(5, 30))]
+
+            if rnd.random() < time_ratio:
+                h, m = rnd.randint(0, 23), rnd.choice([0, 0, 0, 15, 30, 45, rnd.randint(0, 59)])
+                time = rnd.choice(TIME_FORMATS).format(h=h, m=m, h12=h % 12 or 12)
+                line.insert(rnd.randint(0, len(line)), rnd.choice(surface_forms))
+                line.insert(rnd.randint(0, len(line)), time)
+
+            f_out.write(separator.join(line) + "\n")
+
+    return out_file
+
+
+def generate_multistream_dump(corpus_file, dump_file, lines_per_page=20, pages_per_stream=100):
+    """
+    Converts a synthetic corpus to a bz2 multistream dump like the official Wikipedia ones:
+    a stream with the site info, streams of pages_per_stream pages, and a closing stream, with
+    the offset, ID and title of each page in the index (*-index.txt.bz2).
+    Every other page is wrapped with some wiki markup, and each stream has a redirect page.
+    """
+    with gzip.open(corpus_file, "rt", encoding="utf-8") as f_in:
+        lines = [line.rstrip("\n") for line in f_in]
+
+    pages = [lines[i:i + lines_per_page] for i in range(0, len(lines), lines_per_page)]
+    index = []
+
+    with open(dump_file, "wb") as f_out:
+        f_out.write(bz2.compress("<mediawiki>\n  <siteinfo>\n  </siteinfo>\n".encode("utf-8")))
+
+        for start in range(0, len(pages), pages_per_stream):
+            offset = f_out.tell()
+            xml = [page_xml(f"redirect_{start}", "#REDIRECT [[Page 1]]", redirect=True)]
+
+            for page_id in range(start + 1, min(start + pages_per_stream, len(pages)) + 1):
+                text = "\n".join(pages[page_id - 1])
+                if page_id % 2 == 0:
+                    text = "{{Infobox|name={{lang|x}}}}\n== Section ==\n'''" + text + "'''<ref>{{cite}}</ref>"
+
+                xml.append(page_xml(f"Page {page_id}", text))
+                index.append(f"{offset}:{page_id}:Page {page_id}")
+
+            f_out.write(bz2.compress("".join(xml).encode("utf-8")))
+
+        f_out.write(bz2.compress("</mediawiki>\n".encode("utf-8")))
+
+    with bz2.open(multistream_index(dump_file), "wt", encoding="utf-8") as f_out:
+        f_out.write("\n".join(index) + "\n")
+
+    return dump_file
+
+
+def page_xml(title, text, redirect=False):
+    redirect = f'    <redirect title="{title}" />\n' if redirect else ""
+    return f"  <page>\n    <title>{title}</title>\n    <ns>0</ns>\n{redirect}    <revision>\n" \
+           f'      <text bytes="{len(text)}" xml:space="preserve">{html.escape(text)}</text>\n' \
+           f"    </revision>\n  </page>\n"
+
+
+def build_tiny_model(out_dir, seed=0):
+    """
+    Saves a tiny randomly initialized BERT with a word-level vocabulary built from the templates,
+    time expressions and AM/PM words of all languages, so that the LM benchmarks run offline.
+    """
+    vocab = ["[PAD]", "[UNK]", "[CLS]", "[SEP]", "[MASK]"] + [str(num) for num in range(25)] + \
+            ["0" + str(num) for num in range(10)]
+
+    for file in sorted(os.listdir("data/templates/distribution")):
+        vocab += [word for line in open(f"data/templates/distribution/{file}")
+                  for word in line.replace("[MASK]", " ").split()]
+
+    for file in sorted(os.listdir("data/time_expressions")):
+        vocab += [exp for line in open(f"data/time_expressions/{file}") for exp in line.strip().split("\t")[1].split("|")]
+
+    for file in sorted(os.listdir("data/ampm")):
+        vocab += [v for vals in json.load(open(f"data/ampm/{file}")).values() for v in vals]
+
+    os.makedirs(out_dir, exist_ok=True)
+    with open(f"{out_dir}/vocab.txt", "w", encoding="utf-8") as f_out:
+        f_out.write("\n".join(dict.fromkeys(vocab)) + "\n")
+
+    tokenizer = BertTokenizer(f"{out_dir}/vocab.txt", do_lower_case=False)
+    tokenizer.save_pretrained(out_dir)
+
+    config = BertConfig(vocab_size=len(tokenizer), hidden_size=64, num_hidden_layers=2,
+                        num_attention_heads=2, intermediate_size=128, max_position_embeddings=128)
+    BertForMaskedLM(config).save_pretrained(out_dir)
+    return out_dir
+
+
+def synthetic_grounding(expressions, seed=0):
+    """
+    Returns random hour counts ({exp: {hour: count}}) and start/end scores
+    ({exp: {edge: {hour: score}}}) for the solvers
+    """
+    rnd = random.Random(seed)
+    counts = {exp: {h: rnd.randint(0, 1000) for h in range(24)} for exp in expressions}
+    start_end = {exp: {edge: {h: rnd.random() for h in range(24)} for edge in ["start", "end"]}
+                 for exp in expressions}
+    return counts, start_end
+
+
+def synthetic_annotations(num_annotations=200, seed=0):
+    """
+    Returns random annotated times ("h:mm") around the day, some with AM/PM mixups
+    """
+    rnd = random.Random(seed)
+    hours = [int(rnd.gauss(8, 1.5)) % 24 for _ in range(num_annotations)]
+    hours = [(h + 12) % 24 if rnd.random() < 0.05 else h for h in hours]
+    return [f"{h}:{rnd.choice([0, 0, 15, 30, 45]):02d}" for h in hours]
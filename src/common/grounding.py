@@ -0,0 +1,174 @@
+import os
+import sys
+import json
+import argparse
+import numpy as np
+
+from src.common.outputs import load_output
+from src.common.time_expressions import compile_matchers, load_time_expressions
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--lang", default="en", type=str, required=False, help="Language code")
+    parser.add_argument("--model", default="extractive", type=str, required=False,
+                        help="Which groundings to use: extractive, lm_based or baseline")
+    parser.add_argument("--kind", default="24", type=str, required=False,
+                        help="24 (hour distribution) or start_end")
+    parser.add_argument("--output_dir", default="output", type=str, required=False,
+                        help="Directory with the outputs of each model")
+    parser.add_argument("--in_file", default=None, type=str, required=False,
+                        help="Text file with one sentence per line. Default: stdin")
+    parser.add_argument("--out_file", default=None, type=str, required=False,
+                        help="Where to save the time expressions found in each line (jsonl). Default: stdout")
+    args = parser.parse_args()
+
+    index = GroundingIndex(args.output_dir, args.model, args.kind)
+    f_in = open(args.in_file, encoding="utf-8") if args.in_file is not None else sys.stdin
+    f_out = open(args.out_file, "w", encoding="utf-8") if args.out_file is not None else sys.stdout
+
+    # Lines are read, matched and written one at a time
+    texts = (line.rstrip("\n") for line in f_in)
+    for matches in index.normalize(texts, args.lang):
+        f_out.write(json.dumps(matches, ensure_ascii=False) + "\n")
+
+    f_out.flush()
+
+
+class GroundingIndex:
+    """
+    In-memory index of the groundings in {output_dir}/{model}/{lang}_{kind}.json, keyed by
+    (language, English label). Each language is loaded on its first lookup.
+    """
+    def __init__(self, output_dir="output", model="extractive", kind="24"):
+        self.output_dir = output_dir
+        self.model = model
+        self.kind = kind
+        self.groundings = {}
+        self.loaded = {}
+        self.matchers = {}
+
+    def languages(self):
+        """
+        The languages with a grounding file
+        """
+        suffix = f"_{self.kind}.json"
+        langs = [file[:-len(suffix)] for file in os.listdir(f"{self.output_dir}/{self.model}") if file.endswith(suffix)]
+
+        # Empty files have no groundings
+        for lang in langs:
+            self.load(lang)
+
+        return sorted(lang for lang in langs if self.loaded[lang])
+
+    def load(self, lang):
+        """
+        Adds the grounding of each time expression in the language to the index.
+        A language without a grounding file, or with an empty one, has no groundings.
+        """
+        if lang in self.loaded:
+            return
+
+        grounding = load_output(f"{self.output_dir}/{self.model}/{lang}_{self.kind}.json") or {}
+        self.loaded[lang] = len(grounding) > 0
+
+        for exp, values in grounding.items():
+            self.groundings[(lang, exp)] = to_entry(values)
+
+    def get(self, lang, exp):
+        """
+        Returns {"distribution": probability of each hour or None, "start": ..., "end": ...}
+        for the English label of a time expression, or None if it has no grounding
+        """
+        self.load(lang)
+        return self.groundings.get((lang, exp))
+
+    def distribution(self, lang, exp):
+        return self[lang, exp]["distribution"]
+
+    def interval(self, lang, exp):
+        """
+        The start and end hours (floats). The interval wraps around midnight when start > end.
+        """
+        entry = self[lang, exp]
+        return entry["start"], entry["end"]
+
+    def __getitem__(self, key):
+        entry = self.get(*key)
+        if entry is None:
+            raise KeyError(key)
+
+        return entry
+
+    def matcher(self, lang):
+        """
+        The time expression regex of the language (as in find_time_expressions) and
+        the map from each lowercased surface form to its English label
+        """
+        if lang not in self.matchers:
+            time_expressions, label_map = load_time_expressions(lang)
+            time_exp_template, _, labels, surface_ids = compile_matchers(time_expressions, label_map, lang)
+            self.matchers[lang] = time_exp_template, {t: labels[i] for t, i in surface_ids.items()}
+
+        return self.matchers[lang]
+
+    def normalize(self, texts, lang):
+        """
+        Finds the time expressions in each text and yields a list with the surface form,
+        character span, English label, start and end of each (start and end are None for
+        expressions without a grounding). Texts are consumed lazily, so this can be used
+        with a generator over a large corpus.
+        """
+        time_exp_template, surface_labels = self.matcher(lang)
+        self.load(lang)
+        groundings = self.groundings
+
+        for text in texts:
+            matches = []
+            for ematch in time_exp_template.finditer(text):
+                exp = surface_labels.get(ematch.group(0).lower())
+                if exp is None:
+                    continue
+
+                entry = groundings.get((lang, exp))
+                matches.append({"text": ematch.group(0), "span": list(ematch.span()), "expression": exp,
+                                "start": entry["start"] if entry is not None else None,
+                                "end": entry["end"] if entry is not None else None})
+
+            yield matches
+
+
+def to_entry(values):
+    """
+    Converts the json grounding of one expression to an index entry
+    """
+    hours = [str(hour) for hour in range(24)]
+    distribution = None
+
+    # The hour distribution is normalized, since it holds counts in the extractive outputs
+    if all(hour in values for hour in hours):
+        distribution = np.array([values[hour] for hour in hours], dtype=np.float64)
+        distribution /= max(distribution.sum(), 1e-12)
+        distribution.flags.writeable = False
+
+    return {"distribution": distribution, "start": values.get("start"), "end": values.get("end")}
+
+
+# The index used by normalize()
+default_index = None
+
+
+def normalize(texts, lang, output_dir="output", model="extractive", kind="24"):
+    """
+    GroundingIndex.normalize() with a shared index
+    """
+    global default_index
+    if default_index is None or (default_index.output_dir, default_index.model, default_index.kind) != \
+            (output_dir, model, kind):
+        default_index = GroundingIndex(output_dir, model, kind)
+
+    return default_index.normalize(texts, lang)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,13 @@
+import os
+import json
+
+
+def load_output(file):
+    """
+    Loads a json output file. Returns None if the file is missing or empty (some of the outputs are empty files).
+    """
+    if not os.path.exists(file) or os.path.getsize(file) == 0:
+        return None
+
+    with open(file) as f_in:
+        return json.load(f_in)
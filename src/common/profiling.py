@@ -0,0 +1,161 @@
+import os
+import json
+import time
+import pstats
+import cProfile
+import resource
+import contextlib
+
+# The report of the current run, used by count() and observe()
+active_report = None
+
+
+class RunReport:
+    """
+    Collects the time, counters and peak memory of each stage of a run for one language,
+    and saves them as a json file next to the outputs.
+    """
+    def __init__(self, script, lang):
+        self.script = script
+        self.lang = lang
+        self.stages = {}
+        self.current_stage = "main"
+
+    def get_stage(self, name):
+        return self.stages.setdefault(name, {"seconds": 0.0, "counters": {}, "observations": {}})
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        """
+        Times a stage of the run. Counters recorded within it are attached to it.
+        """
+        prev_stage, self.current_stage = self.current_stage, name
+        stage = self.get_stage(name)
+        start = time.perf_counter()
+
+        try:
+            yield stage
+        finally:
+            stage["seconds"] += time.perf_counter() - start
+            stage["peak_rss_mb"] = peak_rss_mb()
+            self.current_stage = prev_stage
+
+    def count(self, name, n=1):
+        counters = self.get_stage(self.current_stage)["counters"]
+        counters[name] = counters.get(name, 0) + n
+
+    def observe(self, name, value):
+        """
+        Records a value such as a batch size: the number of observations, mean and max.
+        """
+        observations = self.get_stage(self.current_stage)["observations"]
+        curr = observations.setdefault(name, {"count": 0, "sum": 0, "max": value})
+        curr["count"] += 1
+        curr["sum"] += value
+        curr["max"] = max(curr["max"], value)
+
+    def merge(self, stages):
+        """
+        Adds the stages recorded by another (worker) report
+        """
+        for name, other in stages.items():
+            stage = self.get_stage(name)
+            stage["seconds"] += other["seconds"]
+            stage["peak_rss_mb"] = max(stage.get("peak_rss_mb", 0), other.get("peak_rss_mb", 0))
+
+            for counter, n in other["counters"].items():
+                stage["counters"][counter] = stage["counters"].get(counter, 0) + n
+
+            for key, obs in other["observations"].items():
+                curr = stage["observations"].setdefault(key, {"count": 0, "sum": 0, "max": obs["max"]})
+                curr["count"] += obs["count"]
+                curr["sum"] += obs["sum"]
+                curr["max"] = max(curr["max"], obs["max"])
+
+    def to_dict(self):
+        stages = {}
+        for name, stage in self.stages.items():
+            seconds = stage["seconds"]
+            stages[name] = {
+                "seconds": seconds,
+                "peak_rss_mb": stage.get("peak_rss_mb", peak_rss_mb()),
+                "counters": stage["counters"],
+                "per_second": {counter: n / seconds for counter, n in stage["counters"].items() if seconds > 0},
+                "observations": {key: {"count": obs["count"], "mean": obs["sum"] / obs["count"], "max": obs["max"]}
+                                 for key, obs in stage["observations"].items()}}
+
+        return {"script": self.script, "lang": self.lang, "stages": stages}
+
+    def save(self, out_dir):
+        """
+        Saves the report to out_dir/reports/{lang}_{script}.json
+        """
+        os.makedirs(f"{out_dir}/reports", exist_ok=True)
+        with open(report_path(out_dir, self.script, self.lang), "w") as f_out:
+            json.dump(self.to_dict(), f_out, indent=2)
+
+
+def start_run(script, lang):
+    """
+    Starts a new report and makes it the active one
+    """
+    global active_report
+    active_report = RunReport(script, lang)
+    return active_report
+
+
+def count(name, n=1):
+    """
+    Increments a counter of the active report, if there is one
+    """
+    if active_report is not None:
+        active_report.count(name, n)
+
+
+def observe(name, value):
+    """
+    Records a value in the active report, if there is one
+    """
+    if active_report is not None:
+        active_report.observe(name, value)
+
+
+def stage(name):
+    """
+    Times a stage of the active report, if there is one
+    """
+    if active_report is None:
+        return contextlib.nullcontext()
+
+    return active_report.stage(name)
+
+
+def report_path(out_dir, script, lang, extension="json"):
+    return f"{out_dir}/reports/{lang}_{script}.{extension}"
+
+
+@contextlib.contextmanager
+def profile(path, enabled=True):
+    """
+    Runs the block under cProfile and saves the stats to path (to be viewed with pstats or snakeviz)
+    """
+    if not enabled:
+        yield
+        return
+
+    profiler = cProfile.Profile()
+    profiler.enable()
+
+    try:
+        yield
+    finally:
+        profiler.disable()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        pstats.Stats(profiler).dump_stats(path)
+
+
+def peak_rss_mb():
+    """
+    Peak resident set size of the process so far in MB
+    """
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
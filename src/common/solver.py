@@ -0,0 +1,63 @@
+import gurobipy as gb
+
+from src.common import profiling
+
+
+class SolverSession:
+    """
+    Reuses the ILP models across groundings (languages, models) with the same expressions.
+    The variables and constraints are built once per expression set. For each grounding only the
+    objective coefficients are updated in place, and the solver is warm-started from the previous
+    solution, which satisfies the same constraints. The model is defined by the functions:
+
+    structure_key(grounding, expressions): groundings with the same key share the same model
+    build(grounding, expressions): returns the model (without an objective) and its variables
+    objective(variables, grounding): returns the variables in the objective and their coefficients
+    solution(variables, grounding): returns the start and end of each expression: {exp: {"start": ..., "end": ...}}
+    """
+    def __init__(self, structure_key, build, objective, solution):
+        self.structure_key = structure_key
+        self.build = build
+        self.objective = objective
+        self.solution = solution
+        self.models = {}
+
+    def solve(self, grounding, expressions, iis_file="model_iis.ilp"):
+        """
+        Solves the model with the coefficients of the grounding. Returns None if it is infeasible,
+        and saves the irreducible inconsistent subsystem to iis_file.
+        """
+        with profiling.stage("create_ilp_model"):
+            key = self.structure_key(grounding, expressions)
+            if key not in self.models:
+                self.models[key] = self.build(grounding, expressions)
+                profiling.count("models_built")
+
+            model, variables = self.models[key]
+
+            # The previous solution (read before the model is modified)
+            all_vars = model.getVars()
+            start = model.getAttr("X", all_vars) if model.SolCount > 0 else None
+
+            obj_vars, coefficients = self.objective(variables, grounding)
+            model.setAttr("Obj", obj_vars, coefficients)
+            model.ModelSense = gb.GRB.MAXIMIZE
+
+            if start is not None:
+                model.setAttr("Start", all_vars, start)
+                profiling.count("warm_starts")
+
+        with profiling.stage("optimize"):
+            model.optimize()
+            profiling.count("variables", model.NumVars)
+            profiling.count("constraints", model.NumConstrs + model.NumGenConstrs)
+            profiling.observe("solver_runtime", model.Runtime)
+
+        if model.status == gb.GRB.INFEASIBLE:
+            print("Model is infeasible")
+            model.computeIIS()
+            model.write(iis_file)
+            return None
+
+        return self.solution(variables, grounding)
+
@@ -0,0 +1,68 @@
+import re
+
+
+def load_time_expressions(lang):
+    """
+    Loads the (lowercased) time expressions of the language and the map from each surface form to its English label
+    """
+    time_expressions = [line.lower().strip().split("\t") for line in open(f"data/time_expressions/{lang}.txt")]
+    label_map = {exp: time_expressions[i][0] for i in range(len(time_expressions))
+                 for exp in time_expressions[i][1].split("|")}
+    return time_expressions, label_map
+
+
+def expression_labels(label_map):
+    """
+    The English labels in the order of the rows of the count matrix
+    """
+    return list(dict.fromkeys(label_map.values()))
+
+
+def time_slot(tmatch, resolution=24):
+    """
+    Returns the hour (resolution=24) or minute of the day (resolution=1440) of a time regex match
+    """
+    if tmatch.group("h12") is not None:
+        hour = int(tmatch.group("h12")) % 12 + (12 if tmatch.group("ampm")[0] in "pP" else 0)
+        minute = int(tmatch.group("m12"))
+    else:
+        hour, minute = int(tmatch.group("h24")), int(tmatch.group("m24"))
+
+    return hour if resolution == 24 else hour * 60 + minute
+
+
+def compile_matchers(time_expressions, label_map, lang):
+    """
+    Compiles the time expression and time regexes. Returns them with the English labels
+    (the rows of the count matrix) and a map from each surface form to its row.
+    """
+    is_asian = lang in {"ja", "zh"}
+    allow_compounds = lang in {"de", "fi", "sv", "hi"}
+    labels = expression_labels(label_map)
+
+    # Regex to find sentences with time expressions. Each entry may contain multiple surface forms.
+    time_exp_mapping = {t: entry[1].split("|")[0] for entry in time_expressions for t in entry[1].split("|")}
+    all_time_expressions = [t for entry in time_expressions for t in entry[1].split("|")]
+
+    # Map each surface form directly to its row in the count matrix
+    label_ids = {exp: i for i, exp in enumerate(labels)}
+    surface_ids = {t: label_ids[label_map[time_exp_mapping[t]]] for t in time_exp_mapping.keys()}
+
+    # Allow for compound words in German, Finnish, and Swedish.
+    # In Asian languages there are no spaces.
+    time_exp_template = "(" + "|".join([rf"\b{exp}\b" for exp in all_time_expressions]) + ")"
+    if allow_compounds or is_asian:
+        time_exp_template = "(" + "|".join([rf"{exp}" for exp in all_time_expressions]) + ")"
+    time_exp_template = re.compile(time_exp_template, re.IGNORECASE)
+
+    return time_exp_template, compile_time_regex(), labels, surface_ids
+
+
+def compile_time_regex():
+    """
+    Regex to find times
+    """
+    regex24 = "(?P<h24>2[0-3]|[01]?\d):(?P<m24>[0-5]\d)"
+    regex12 = "(?P<h12>0?[1-9]|1[0-2]):(?P<m12>[0-5]\d)\s?(?P<ampm>(a\.?m\.?)|(p\.?m\.?))"
+    time_regex = "(" + "|".join([regex12, regex24]) + ")"
+    return re.compile(time_regex, re.IGNORECASE)
@@ -1,18 +1,52 @@
+import sys
 import json
 import argparse
+import traceback
 import gurobipy as gb
 
+from src.common import profiling
+from src.common.outputs import load_output
+from src.common.solver import SolverSession
+
 
 def main():
     parser = argparse.ArgumentParser()
-    parser.add_argument("--lang", default="en", type=str, required=False, help="Language code")
-    parser.add_argument("--out_dir", default="output/lm_based/", type=str, required=False, help="Output directory")
+    parser.add_argument("--langs", "--lang", default="en", type=str, required=False,
+                        help="Comma-separated language codes")
+    parser.add_argument("--out_dir", default=["output/lm_based/"], type=str, nargs="+", required=False,
+                        help="Output directories (e.g. of different models)")
+    parser.add_argument("--profile", action="store_true", help="Save cProfile stats next to the run report")
     args = parser.parse_args()
 
-    time_expressions = [line.strip().split("\t") for line in open(f"data/time_expressions/{args.lang}.txt")]
+    # The model is built once per expression set and reused across languages and output directories
+    session = create_session()
+
+    failed = []
+    for out_dir in args.out_dir:
+        for lang in args.langs.split(","):
+            # One bad input file doesn't stop the sweep
+            try:
+                solve_language(out_dir, lang, session, args.profile)
+            except Exception:
+                traceback.print_exc()
+                failed.append(f"{out_dir}/{lang}")
+
+    if len(failed) > 0:
+        print(f"Failed: {', '.join(failed)}")
+        sys.exit(1)
+
+
+def solve_language(out_dir, lang, session, profile=False):
+    """
+    Solves the grounding of a language in out_dir and saves the start and end of each expression
+    """
+    run_report = profiling.start_run("compute_start_end_for_24h_clock", lang)
+    time_expressions = [line.strip().split("\t") for line in open(f"data/time_expressions/{lang}.txt")]
 
-    with open(f"{args.out_dir}/{args.lang}_24.json") as f_in:
-        grounding = json.load(f_in)
+    grounding = load_output(f"{out_dir}/{lang}_24.json")
+    if grounding is None:
+        print(f"Warning: {out_dir}/{lang}_24.json is missing or empty, skipping")
+        return
 
     labels = list(zip(*time_expressions))[0]
     labels = [l for l in labels if l != "before morning" and l in grounding.keys()]
@@ -22,42 +56,57 @@ def main():
                  if exp != "before morning"}
 
     # Infer 24hr clock with ILP
-    start_end = solve_ilp(grounding, labels)
+    with profiling.profile(profiling.report_path(out_dir, run_report.script, lang, "prof"), profile):
+        start_end = solve_ilp(grounding, labels, session, iis_file=f"{out_dir}/{lang}_24_iis.ilp")
 
     if start_end is not None:
         for exp in grounding.keys():
             grounding[exp].update(start_end[exp])
 
-        with open(f"{args.out_dir}/{args.lang}_24.json", "w") as f_out:
+        with open(f"{out_dir}/{lang}_24.json", "w") as f_out:
             json.dump(grounding, f_out)
 
+    run_report.save(out_dir)
+
 
-def solve_ilp(grounding, expressions):
+def solve_ilp(grounding, expressions, session=None, iis_file="model_iis.ilp"):
     """
     Define and solve the ILP problem and determine the 24-hr clock time
     for each observation
     """
-    params = create_ilp_model(grounding, expressions)
-    model, start_variables, end_variables, cnt_by_var = params
-    model.optimize()
-
-    if model.status == gb.GRB.INFEASIBLE:
-        print("Model is infeasible")
-        model.computeIIS()
-        model.write("model_iis.ilp")
-        return None
-    else:
-        start_end = {exp: {} for exp in grounding.keys()}
-        for exp in grounding.keys():
-            start_end[exp]["start"] = start_variables[exp].getAttr("x")
-            start_end[exp]["end"] = end_variables[exp].getAttr("x")
+    session = session or create_session()
+    return session.solve(grounding, expressions, iis_file)
 
-    return start_end
+
+def create_session():
+    """
+    Reuses the 24-hr clock model for groundings with the same expressions and hours
+    """
+    return SolverSession(model_structure, build_model, model_objective, read_solution)
+
+
+def model_structure(grounding, expressions):
+    return tuple(expressions), tuple((exp, tuple(sorted(vals.keys()))) for exp, vals in grounding.items())
+
+
+def build_model(grounding, expressions):
+    model, start_variables, end_variables, counted_variables = create_ilp_model(grounding, expressions)
+    return model, (start_variables, end_variables, counted_variables)
+
+
+def model_objective(variables, grounding):
+    return create_objective(variables[2], grounding)
+
+
+def read_solution(variables, grounding):
+    start_variables, end_variables, _ = variables
+    return {exp: {"start": start_variables[exp].getAttr("x"), "end": end_variables[exp].getAttr("x")}
+            for exp in grounding.keys()}
 
 
 def create_ilp_model(grounding, expressions):
     """
-    Create the ILP model representing the binary AM/PM variable
+    Create the ILP model representing the binary AM/PM variable (the objective is set by the session)
     """
     # Create a new model
     model = gb.Model("24HrClock")
@@ -67,20 +116,16 @@ def create_ilp_model(grounding, expressions):
 
     # Create the model constraints
     create_constraints(model, start_variables, end_variables, counted_variables, expressions)
+    return model, start_variables, end_variables, counted_variables
 
-    # Create the objective function: maximize number of observations fit inside each range
-    relative_importance = {(exp, h): cnt for exp, vals in grounding.items() for h, cnt in vals.items()}
-    create_objective(model, counted_variables, relative_importance)
-    return model, start_variables, end_variables, relative_importance
 
-
-def create_objective(model, counted_vars, relative_importance):
+def create_objective(counted_vars, grounding):
     """
-    Create the objective function: maximize number of observations fit inside each range
+    Create the objective function: maximize number of observations fit inside each range.
+    Returns the variables and their coefficients.
     """
-    num_obs_within_range = [relative_importance[(exp, h)] * counted_vars[(exp, h)][0]
-                            for exp, h in relative_importance.keys()]
-    model.setObjective(gb.quicksum(num_obs_within_range), gb.GRB.MAXIMIZE)
+    relative_importance = {(exp, h): cnt for exp, vals in grounding.items() for h, cnt in vals.items()}
+    return [counted_vars[key][0] for key in relative_importance.keys()], list(relative_importance.values())
 
 
 def create_variables(grounding, model):
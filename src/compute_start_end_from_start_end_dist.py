@@ -1,63 +1,122 @@
+import sys
 import json
 import argparse
+import traceback
 import gurobipy as gb
 
+from src.common import profiling
+from src.common.outputs import load_output
+from src.common.solver import SolverSession
+
 
 def main():
     parser = argparse.ArgumentParser()
-    parser.add_argument("--lang", default="en", type=str, required=False, help="Language code")
-    parser.add_argument("--out_dir", default="output/lm_based/", type=str, required=False, help="Output directory")
+    parser.add_argument("--langs", "--lang", default="en", type=str, required=False,
+                        help="Comma-separated language codes")
+    parser.add_argument("--out_dir", default=["output/lm_based/"], type=str, nargs="+", required=False,
+                        help="Output directories (e.g. of different models)")
+    parser.add_argument("--profile", action="store_true", help="Save cProfile stats next to the run report")
     args = parser.parse_args()
 
-    time_expressions = [line.strip().split("\t") for line in open(f"data/time_expressions/{args.lang}.txt")]
+    # The model is built once per expression set and reused across languages and output directories
+    session = create_session()
 
-    with open(f"{args.out_dir}/{args.lang}_start_end.json") as f_in:
-        grounding = json.load(f_in)
+    failed = []
+    for out_dir in args.out_dir:
+        for lang in args.langs.split(","):
+            # One bad input file doesn't stop the sweep
+            try:
+                solve_language(out_dir, lang, session, args.profile)
+            except Exception:
+                traceback.print_exc()
+                failed.append(f"{out_dir}/{lang}")
 
-    labels = list(zip(*time_expressions))[0]
-    labels = [l for l in labels if l != "before morning" and l in grounding.keys()]
+    if len(failed) > 0:
+        print(f"Failed: {', '.join(failed)}")
+        sys.exit(1)
 
-    grounding = {exp: {edge: {int(hr): cnt for hr, cnt in per_edge.items() if hr not in {"start", "end"}}
-                       for edge, per_edge in per_exp.items()}
-                       for exp, per_exp in grounding.items()
-                 if exp != "before morning"}
+
+def solve_language(out_dir, lang, session, profile=False):
+    """
+    Solves the start and end distributions of a language in out_dir and saves the start and end of each expression
+    """
+    run_report = profiling.start_run("compute_start_end_from_start_end_dist", lang)
+    grounding = load_output(f"{out_dir}/{lang}_start_end.json")
+    if grounding is None:
+        print(f"Warning: {out_dir}/{lang}_start_end.json is missing or empty, skipping")
+        return
 
     # Infer 24hr clock with ILP
-    start_end = solve_ilp(grounding, labels)
+    with profiling.profile(profiling.report_path(out_dir, run_report.script, lang, "prof"), profile):
+        grounding, start_end = solve_grounding(
+            grounding, lang, session, iis_file=f"{out_dir}/{lang}_start_end_iis.ilp")
 
     if start_end is not None:
         for exp in grounding.keys():
             grounding[exp].update(start_end[exp])
 
-        with open(f"{args.out_dir}/{args.lang}_start_end.json", "w") as f_out:
+        with open(f"{out_dir}/{lang}_start_end.json", "w") as f_out:
             json.dump(grounding, f_out)
 
+    run_report.save(out_dir)
 
-def solve_ilp(grounding, expressions):
+
+def solve_grounding(grounding, lang, session=None, iis_file="model_iis.ilp"):
+    """
+    Converts the start and end distributions of a language (as saved by extract_start_end_from_lm)
+    to hour scores and solves them. Returns the scores and the start and end of each expression
+    (None if the model is infeasible).
+    """
+    time_expressions = [line.strip().split("\t") for line in open(f"data/time_expressions/{lang}.txt")]
+    labels = list(zip(*time_expressions))[0]
+    labels = [l for l in labels if l != "before morning" and l in grounding.keys()]
+
+    grounding = {exp: {edge: {int(hr): cnt for hr, cnt in per_edge.items() if hr not in {"start", "end"}}
+                       for edge, per_edge in per_exp.items()}
+                 for exp, per_exp in grounding.items()
+                 if exp != "before morning"}
+
+    return grounding, solve_ilp(grounding, labels, session, iis_file)
+
+
+def solve_ilp(grounding, expressions, session=None, iis_file="model_iis.ilp"):
     """
     Define and solve the ILP problem and determine the 24-hr clock time
     for each observation
     """
-    model, start_variables, end_variables = create_ilp_model(grounding, expressions)
-    model.optimize()
+    session = session or create_session()
+    return session.solve(grounding, expressions, iis_file)
 
-    if model.status == gb.GRB.INFEASIBLE:
-        print("Model is infeasible")
-        model.computeIIS()
-        model.write("model_iis.ilp")
-        return None
-    else:
-        start_end = {exp: {} for exp in grounding.keys()}
-        for exp in grounding.keys():
-            start_end[exp]["start"] = start_variables[exp][0].getAttr("x")
-            start_end[exp]["end"] = end_variables[exp][0].getAttr("x")
 
-    return start_end
+def create_session():
+    """
+    Reuses the start/end model for groundings with the same expressions
+    """
+    return SolverSession(model_structure, build_model, model_objective, read_solution)
+
+
+def model_structure(grounding, expressions):
+    return tuple(expressions), tuple(grounding.keys())
+
+
+def build_model(grounding, expressions):
+    model, start_vars, end_vars = create_ilp_model(grounding, expressions)
+    return model, (start_vars, end_vars)
+
+
+def model_objective(variables, grounding):
+    return create_objective(grounding, *variables)
+
+
+def read_solution(variables, grounding):
+    start_vars, end_vars = variables
+    return {exp: {"start": start_vars[exp][0].getAttr("x"), "end": end_vars[exp][0].getAttr("x")}
+            for exp in grounding.keys()}
 
 
 def create_ilp_model(grounding, expressions):
     """
-    Create the ILP model representing the binary AM/PM variable
+    Create the ILP model representing the binary AM/PM variable (the objective is set by the session)
     """
     # Create a new model
     model = gb.Model("24HrClock")
@@ -67,20 +126,17 @@ def create_ilp_model(grounding, expressions):
 
     # Create the model constraints
     create_constraints(model, start_vars, end_vars, expressions)
-
-    # Create the objective function
-    create_objective(model, grounding, start_vars, end_vars)
     return model, start_vars, end_vars
 
 
-def create_objective(model, grounding, start_vars, end_vars):
+def create_objective(grounding, start_vars, end_vars):
     """
-    Create the objective function: maximize score of start and end time
+    Create the objective function: maximize score of start and end time.
+    Returns the variables and their coefficients.
     """
-    scores = [grounding[exp][edge][h] * curr_vars[exp][1][h]
-              for edge, curr_vars in zip(["start", "end"], [start_vars, end_vars])
-              for exp in grounding.keys() for h in range(24)]
-    model.setObjective(gb.quicksum(scores), gb.GRB.MAXIMIZE)
+    keys = [(edge, curr_vars, exp, h) for edge, curr_vars in zip(["start", "end"], [start_vars, end_vars])
+            for exp in grounding.keys() for h in range(24)]
+    return [curr_vars[exp][1][h] for _, curr_vars, exp, h in keys], [grounding[exp][edge][h] for edge, _, exp, h in keys]
 
 
 def create_variables(grounding, model):
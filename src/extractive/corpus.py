@@ -0,0 +1,264 @@
+import os
+import re
+import bz2
+import gzip
+import html
+import mmap
+
+from src.common import profiling
+
+# Every time matched by the time regex contains a clock time like this (with ASCII digits)
+CLOCK_TIME_BYTES = re.compile(rb"\d:[0-5]\d")
+
+# Pages and their text in the XML of a Wikipedia dump
+PAGE_REGEX = re.compile(r"<page>.*?</page>", re.DOTALL)
+TEXT_REGEX = re.compile(r"<text[^>]*>(.*?)</text>", re.DOTALL)
+
+# Light wiki markup cleaning, applied in order. Templates, links and tables are handled separately.
+WIKI_MARKUP = [(re.compile(r"<!--.*?-->", re.DOTALL), ""),
+               (re.compile(r"<ref[^>/]*/>|<ref[^>]*>.*?</ref>", re.DOTALL | re.IGNORECASE), ""),
+               (re.compile(r"\[https?://[^\s\]]*\s?([^\]]*)\]"), r"\1"),
+               (re.compile(r"'{2,}"), ""),
+               (re.compile(r"<[^>]+>"), ""),
+               (re.compile(r"^=+\s*(.*?)\s*=+\s*$", re.MULTILINE), r"\1")]
+TEMPLATE_REGEX = re.compile(r"\{\{[^{}]*\}\}")
+LINK_REGEX = re.compile(r"\[\[(?:[^\[\]|]*\|)*([^\[\]|]*)\]\]")
+TABLE_REGEX = re.compile(r"^\{\|.*?^\|\}", re.DOTALL | re.MULTILINE)
+
+
+def index_prefix(index_dir, lang):
+    """
+    The path of the index of lines with a time (without extension)
+    """
+    return f"{index_dir}/{lang}_time_lines"
+
+
+def is_multistream(corpus_file):
+    return corpus_file.endswith(".bz2")
+
+
+def multistream_index(dump_file):
+    """
+    The offset index of a multistream dump: *-multistream.xml.bz2 -> *-multistream-index.txt.bz2
+    """
+    return re.sub(r"\.xml\.bz2$", "-index.txt.bz2", dump_file)
+
+
+def read_stream_ranges(dump_file, index_file=None):
+    """
+    Returns the (start, end) byte offsets of the bz2 streams with pages in a multistream dump,
+    from its index file (lines of offset:page_id:title). The first stream, with the site info,
+    has no pages and is skipped.
+    """
+    offsets = []
+    with bz2.open(index_file or multistream_index(dump_file), "rt", encoding="utf-8") as f_in:
+        for line in f_in:
+            offset = int(line[:line.index(":")])
+            if len(offsets) == 0 or offset != offsets[-1]:
+                offsets.append(offset)
+
+    # The last stream ends with the closing tag of the dump
+    offsets = sorted(set(offsets)) + [os.path.getsize(dump_file)]
+    return list(zip(offsets[:-1], offsets[1:]))
+
+
+def open_corpus(corpus_file, position=0, use_mmap=False, streams=None, skip_lines=0):
+    """
+    Opens a corpus file for reading lines from the given position.
+    For multistream dumps, only the given streams are read.
+    """
+    if streams is not None:
+        return MultistreamCorpus(corpus_file, streams, position, skip_lines)
+
+    if use_mmap:
+        return MmapCorpus(corpus_file, position)
+
+    return GzipCorpus(corpus_file, position)
+
+
+def reader_mode(use_mmap=False, streams=None):
+    """
+    The reader that open_corpus uses, which determines the meaning of the positions
+    """
+    if streams is not None:
+        return "multistream"
+
+    return "mmap" if use_mmap else "gzip"
+
+
+class GzipCorpus:
+    """
+    Reads a gzip corpus line by line, starting from a position in the uncompressed stream
+    """
+    def __init__(self, corpus_file, position=0):
+        self.f_in = gzip.open(corpus_file, "r")
+
+        # Seeking in a gzip stream decompresses up to the position, but skips the matching
+        self.f_in.seek(position)
+
+    def __iter__(self):
+        for line in self.f_in:
+            yield line.decode("utf-8", errors="ignore")
+
+    def position(self):
+        """
+        The position after the last line read, in the uncompressed stream
+        """
+        return {"position": self.f_in.tell()}
+
+    def close(self):
+        self.f_in.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class MmapCorpus:
+    """
+    Memory-maps an uncompressed corpus and searches the raw bytes for clock times. Only the lines
+    that contain one are decoded, since the other lines can't match the time regex. Clock times
+    with non-ASCII digits are not found in this mode.
+    """
+    def __init__(self, corpus_file, position=0):
+        self.file = open(corpus_file, "rb")
+        self.curr_position = position
+
+        # Empty files can't be memory-mapped
+        if os.path.getsize(corpus_file) > 0:
+            self.buffer = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            self.buffer = b""
+
+    def __iter__(self):
+        buffer, start_position = self.buffer, self.curr_position
+        match = CLOCK_TIME_BYTES.search(buffer, start_position)
+
+        while match is not None:
+            start = buffer.rfind(b"\n", 0, match.start()) + 1
+            end = buffer.find(b"\n", match.end())
+            end = len(buffer) if end == -1 else end + 1
+            self.curr_position = end
+
+            yield buffer[start:end].decode("utf-8", errors="ignore")
+            match = CLOCK_TIME_BYTES.search(buffer, end)
+
+        profiling.count("bytes", len(buffer) - start_position)
+        self.curr_position = len(buffer)
+
+    def position(self):
+        """
+        The byte offset after the last line read
+        """
+        return {"position": self.curr_position}
+
+    def close(self):
+        if isinstance(self.buffer, mmap.mmap):
+            self.buffer.close()
+
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class MultistreamCorpus:
+    """
+    Reads the article text of a range of streams of a bz2 multistream Wikipedia dump. Each stream
+    is seeked to and decompressed independently, so the streams can be split between workers.
+    The position is the offset of the current stream and the number of lines read from it.
+    """
+    def __init__(self, corpus_file, streams, position=0, skip_lines=0):
+        self.file = open(corpus_file, "rb")
+        self.streams = streams
+        self.curr_position = max(position, streams[0][0]) if len(streams) > 0 else position
+        self.curr_lines = skip_lines if position == self.curr_position else 0
+
+    def __iter__(self):
+        start_position, skip_lines = self.curr_position, self.curr_lines
+
+        for start, end in self.streams:
+            if start < start_position:
+                continue
+
+            self.curr_position, self.curr_lines = start, 0
+            self.file.seek(start)
+            xml = bz2.decompress(self.file.read(end - start)).decode("utf-8", errors="ignore")
+            profiling.count("streams")
+            profiling.count("bytes", end - start)
+
+            for line in article_lines(xml):
+                self.curr_lines += 1
+
+                # Already counted before the checkpoint
+                if start == start_position and self.curr_lines <= skip_lines:
+                    continue
+
+                yield line
+
+        if len(self.streams) > 0:
+            self.curr_position, self.curr_lines = self.streams[-1][1], 0
+
+    def position(self):
+        """
+        The offset of the current stream and the number of lines read from it
+        """
+        return {"position": self.curr_position, "stream_lines": self.curr_lines}
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def article_lines(xml):
+    """
+    Yields the non-empty lines of the (cleaned) text of the articles in a chunk of dump XML
+    """
+    num_pages = 0
+
+    for page in PAGE_REGEX.finditer(xml):
+        page = page.group(0)
+
+        # Only articles, without redirects
+        if "<ns>0</ns>" not in page or "<redirect" in page:
+            continue
+
+        text = TEXT_REGEX.search(page)
+        if text is None:
+            continue
+
+        num_pages += 1
+        for line in clean_wikitext(html.unescape(text.group(1))).split("\n"):
+            line = line.strip()
+            if len(line) > 0:
+                yield line
+
+    profiling.count("pages", num_pages)
+
+
+def clean_wikitext(text):
+    """
+    Removes templates, tables, references, comments and tags, and replaces links by their label.
+    Keeps the text and times intact, so it doesn't need to be as thorough as wikiextractor.
+    """
+    text = TABLE_REGEX.sub("", text)
+
+    # Remove nested templates and replace nested links by their label, from the inside out
+    prev = None
+    while prev != text:
+        prev, text = text, LINK_REGEX.sub(r"\1", TEMPLATE_REGEX.sub("", text))
+
+    for regex, replacement in WIKI_MARKUP:
+        text = regex.sub(replacement, text)
+
+    return text
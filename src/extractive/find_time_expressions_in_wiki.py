@@ -1,10 +1,18 @@
-import re
-import gzip
+import os
 import tqdm
 import json
+import logging
 import argparse
+import numpy as np
 
-from dateutil import parser
+from multiprocessing import Pool
+
+from src.common import profiling
+from src.common.time_expressions import load_time_expressions, expression_labels, compile_matchers, time_slot
+from src.extractive.corpus import open_corpus, index_prefix, is_multistream, read_stream_ranges, reader_mode
+
+logging.basicConfig(format='%(asctime)s - %(levelname)s - %(name)s - %(message)s', level=logging.INFO)
+logger = logging.getLogger(__name__)
 
 
 def main():
@@ -12,64 +20,235 @@ def main():
     parser.add_argument("--wiki_dir", default=".", type=str, required=False, help="Directory for the wiki files")
     parser.add_argument("--lang", default="en", type=str, required=False, help="Language code")
     parser.add_argument("--out_dir", default="output/extractive", type=str, required=False, help="Output directory")
+    parser.add_argument("--profile", action="store_true", help="Save cProfile stats next to the run report")
+    parser.add_argument("--corpus_files", default=None, type=str, nargs="+", required=False,
+                        help="Corpus shards (gzip files, text files with --mmap, or bz2 multistream "
+                             "Wikipedia dumps with their index next to them). Default: {wiki_dir}/{lang}_wiki.tar.gz")
+    parser.add_argument("--streams_per_shard", default=100, type=int, required=False,
+                        help="Number of bz2 streams of a multistream dump in each shard")
+    parser.add_argument("--index_dir", default=None, type=str, required=False,
+                        help="Scan the index of lines with a time created by src.extractive.index_time_lines "
+                             "in this directory instead of the corpus")
+    parser.add_argument("--num_workers", default=1, type=int, required=False, help="Number of shards to scan in parallel")
+    parser.add_argument("--checkpoint_every", default=1000000, type=int, required=False,
+                        help="Save the counts and stream position of each shard every this many lines")
+    parser.add_argument("--resume", action="store_true", help="Resume from the checkpoints in {out_dir}/checkpoints")
+    parser.add_argument("--mmap", action="store_true",
+                        help="The corpus files are uncompressed text: memory-map them and only decode the lines "
+                             "with a clock time. Times written with non-ASCII digits are not found in this mode")
+    parser.add_argument("--minutes", action="store_true",
+                        help="Also count by minute of the day and save the counts to {out_dir}/{lang}_1440.json")
     args = parser.parse_args()
 
-    corpus_file = f"{args.wiki_dir}/{args.lang}_wiki.tar.gz"
-    time_expressions = [line.lower().strip().split("\t") for line in open(f"data/time_expressions/{args.lang}.txt")]
-    label_map = {exp: time_expressions[i][0] for i in range(len(time_expressions))
-                 for exp in time_expressions[i][1].split("|")}
+    # The index is a gzip file of lines, built from gzip corpus files
+    if args.index_dir is not None and args.mmap:
+        parser.error("--index_dir can't be used with --mmap")
+
+    if args.index_dir is not None and any(is_multistream(file) for file in args.corpus_files or []):
+        parser.error("--index_dir can't be used with bz2 multistream --corpus_files")
+
+    report = profiling.start_run("find_time_expressions_in_wiki", args.lang)
+
+    corpus_files = args.corpus_files or [f"{args.wiki_dir}/{args.lang}_wiki.tar.gz"]
+
+    # The other lines don't contribute to the counts
+    if args.index_dir is not None:
+        corpus_files = [f"{index_prefix(args.index_dir, args.lang)}.gz"]
+    time_expressions, label_map = load_time_expressions(args.lang)
+
+    # One checkpoint per shard
+    resolution = 1440 if args.minutes else 24
+    os.makedirs(f"{args.out_dir}/checkpoints", exist_ok=True)
+    # Multistream dumps are split into shards of streams, which are decompressed independently
+    shard_files = []
+    for corpus_file in corpus_files:
+        if is_multistream(corpus_file):
+            streams = read_stream_ranges(corpus_file)
+            shard_files.extend([(corpus_file, streams[i:i + args.streams_per_shard])
+                                for i in range(0, len(streams), args.streams_per_shard)])
+        else:
+            shard_files.append((corpus_file, None))
+
+    shards = [(corpus_file, time_expressions, label_map, args.lang, resolution, args.mmap,
+               f"{args.out_dir}/checkpoints/{args.lang}_{shard_id}.json", args.checkpoint_every, args.resume, streams)
+              for shard_id, (corpus_file, streams) in enumerate(shard_files)]
 
     # Compute the distribution
-    grounding = find_time_expressions(corpus_file, time_expressions, label_map, args.lang)
+    with profiling.profile(profiling.report_path(args.out_dir, report.script, args.lang, "prof"), args.profile):
+        with report.stage("find_time_expressions"):
+            if args.num_workers > 1:
+                with Pool(args.num_workers) as pool:
+                    results = pool.map(find_time_expressions_in_shard, shards)
+            else:
+                results = [find_time_expressions_in_shard(shard) for shard in shards]
+
+        with report.stage("merge"):
+            for _, stages in results:
+                report.merge(stages)
+
+            counts = sum(shard_counts for shard_counts, _ in results)
+
+    labels = expression_labels(label_map)
+    if args.minutes:
+        with open(f"{args.out_dir}/{args.lang}_1440.json", "w") as f_out:
+            json.dump(counts_to_grounding(counts, labels), f_out)
+
+        counts = to_hours(counts)
 
     with open(f"{args.out_dir}/{args.lang}_24.json", "w") as f_out:
-        json.dump(grounding, f_out)
+        json.dump(counts_to_grounding(counts, labels), f_out)
+
+    report.save(args.out_dir)
+
+
+def find_time_expressions_in_shard(shard):
+    """
+    Scans a single shard (in a worker process) and returns its counts and run report stages
+    """
+    corpus_file, time_expressions, label_map, lang, resolution, use_mmap, checkpoint_file, checkpoint_every, resume, \
+        streams = shard
+    shard_report = profiling.start_run("find_time_expressions_in_shard", lang)
+
+    with shard_report.stage("find_time_expressions"):
+        counts = find_time_expressions(
+            corpus_file, time_expressions, label_map, lang, resolution, use_mmap,
+            checkpoint_file, checkpoint_every, resume, streams=streams)
+
+    return counts, shard_report.stages
+
+
+def counts_to_grounding(counts, labels):
+    """
+    Converts a (labels x slots) count matrix to the json layout: {exp: {slot: count}}
+    """
+    return {exp: {slot: int(cnt) for slot, cnt in enumerate(row)} for exp, row in zip(labels, counts)}
+
+
+def to_hours(counts):
+    """
+    Sums minute counts (labels x 1440) to hour counts (labels x 24)
+    """
+    return counts.reshape(counts.shape[0], 24, -1).sum(axis=-1)
+
+
+def load_checkpoint(checkpoint_file, scan):
+    """
+    Loads the counts and the (uncompressed) stream position of a shard. The checkpoint must be of the
+    same scan: corpus file, reader mode, expressions, resolution and streams.
+    """
+    with open(checkpoint_file) as f_in:
+        checkpoint = json.load(f_in)
+
+    for key, value in scan.items():
+        if checkpoint.get(key) != value:
+            raise ValueError(f"Checkpoint {checkpoint_file} has a different {key} than this scan, "
+                             f"rerun without --resume")
+
+    checkpoint["counts"] = np.array(checkpoint["counts"], dtype=np.int64)
+    return checkpoint
+
+
+def save_checkpoint(checkpoint_file, scan, corpus, counts, done=False):
+    """
+    Saves the counts so far with the position in the corpus
+    (for gzip files: in the uncompressed stream)
+    """
+    checkpoint = {**scan, "done": done, "counts": counts.tolist(), **corpus.position()}
+
+    # Write and rename, so that a crash while saving doesn't corrupt the previous checkpoint
+    with open(checkpoint_file + ".tmp", "w") as f_out:
+        json.dump(checkpoint, f_out)
+
+    os.replace(checkpoint_file + ".tmp", checkpoint_file)
 
 
-def find_time_expressions(corpus_file, time_expressions, label_map, lang):
+def find_time_expressions(corpus_file, time_expressions, label_map, lang, resolution=24, use_mmap=False,
+                          checkpoint_file=None, checkpoint_every=1000000, resume=False, streams=None,
+                          flush_every=65536, max_lines=None):
     """
-    Finds time expressions in the corpus file and returns
-    a list of (time, time expressions, count) tuples
+    Finds time expressions in the corpus file and returns a matrix with the
+    co-occurrence counts of each time expression (ordered by expression_labels)
+    with each hour (resolution=24) or minute of the day (resolution=1440).
+    With use_mmap, the corpus file is uncompressed and only lines with a clock time are read.
+    With streams, the corpus file is a bz2 multistream dump and only the articles in these
+    (start, end) byte ranges are read.
+    If checkpoint_file is specified, the counts and the position are saved
+    every checkpoint_every lines, and the scan can resume from them. With max_lines, the scan stops
+    after max_lines lines as if it was interrupted, and its checkpoint isn't marked as done.
     """
-    is_asian = lang in {"ja", "zh"}
-    allow_compounds = lang in {"de", "fi", "sv", "hi"}
+    time_exp_template, time_regex, labels, surface_ids = compile_matchers(time_expressions, label_map, lang)
 
     # Count the co-occurrences of each cardinal with a time expression
-    grounding = {exp: {h: 0 for h in range(0, 24)} for exp in label_map.values()}
-
-    # Regex to find sentences with time expressions. Each entry may contain multiple surface forms.
-    time_exp_mapping = {t: entry[1].split("|")[0] for entry in time_expressions for t in entry[1].split("|")}
-    all_time_expressions = [t for entry in time_expressions for t in entry[1].split("|")]
-
-    # Allow for compound words in German, Finnish, and Swedish.
-    # In Asian languages there are no spaces.
-    time_exp_template = "(" + "|".join([rf"\b{exp}\b" for exp in all_time_expressions]) + ")"
-    if allow_compounds or is_asian:
-        time_exp_template = "(" + "|".join([rf"{exp}" for exp in all_time_expressions]) + ")"
-    time_exp_template = re.compile(time_exp_template, re.IGNORECASE)
-
-    # Regex to find times
-    regex24 = "(2[0-3]|[01]?\d):([0-5]\d)"
-    regex12 = "(0?[1-9]|1[0-2]):([0-5]\d)\s?((a\.?m\.?)|(p\.?m\.?))"
-    time_regex = "(" + "|".join([regex12, regex24]) + ")"
-    time_regex = re.compile(time_regex, re.IGNORECASE)
-
-    with gzip.open(corpus_file, "r") as f_in:
-        for line in tqdm.tqdm(f_in):
-            try:
-                line = line.decode("utf-8", errors="ignore")
-
-                # Found a time expression
-                for ematch in time_exp_template.finditer(line):
-                    expression = label_map[time_exp_mapping[ematch.group(0).lower()]]
-
-                    # Found a time immediately around the time expression
-                    for tmatch in time_regex.finditer(line):
-                        grounding[expression][parser.parse(tmatch.group(0), ignoretz=True).hour] += 1
-            except:
-                continue
-
-    return grounding
+    counts = np.zeros((len(labels), resolution), dtype=np.int64)
+
+    # What the counts and the position in a checkpoint refer to
+    scan = {"corpus_file": corpus_file, "mode": reader_mode(use_mmap, streams), "labels": labels,
+            "label_map": label_map, "resolution": resolution, "streams": [list(stream) for stream in streams] if streams is not None else None}
+
+    # Resume from the last checkpoint
+    position, skip_lines = 0, 0
+    if resume and checkpoint_file is not None and os.path.exists(checkpoint_file):
+        checkpoint = load_checkpoint(checkpoint_file, scan)
+        counts, position, skip_lines = checkpoint["counts"], checkpoint["position"], checkpoint.get("stream_lines", 0)
+        logger.info(f"Resuming {corpus_file} from position {position}")
+
+        if checkpoint["done"]:
+            return counts
+
+    # Counted locally and added to the run report at the end
+    num_lines, num_expression_matches, num_time_matches, num_unknown = 0, 0, 0, 0
+
+    # Flat (expression, slot) indices, added to the count matrix in batches
+    pairs = []
+
+    def flush():
+        counts.reshape(-1)[:] += np.bincount(pairs, minlength=counts.size)
+        pairs.clear()
+
+    with open_corpus(corpus_file, position, use_mmap, streams, skip_lines) as corpus:
+        for line in tqdm.tqdm(corpus):
+            num_lines += 1
+
+            # Found a time expression
+            exp_ids = []
+            for ematch in time_exp_template.finditer(line):
+                exp_id = surface_ids.get(ematch.group(0).lower())
+
+                # A surface form that doesn't lowercase to the expression list
+                if exp_id is None:
+                    num_unknown += 1
+                else:
+                    exp_ids.append(exp_id)
+
+            # Found a time immediately around the time expression
+            if len(exp_ids) > 0:
+                slots = [time_slot(tmatch, resolution) for tmatch in time_regex.finditer(line)]
+                pairs.extend([exp_id * resolution + slot for exp_id in exp_ids for slot in slots])
+                num_expression_matches += len(exp_ids)
+                num_time_matches += len(exp_ids) * len(slots)
+
+            if len(pairs) >= flush_every:
+                flush()
+
+            if checkpoint_file is not None and num_lines % checkpoint_every == 0:
+                flush()
+                save_checkpoint(checkpoint_file, scan, corpus, counts)
+
+            if max_lines is not None and num_lines >= max_lines:
+                break
+
+        flush()
+        if checkpoint_file is not None:
+            save_checkpoint(checkpoint_file, scan, corpus, counts, done=max_lines is None or num_lines < max_lines)
+
+    if num_unknown > 0:
+        logger.warning(f"Skipped {num_unknown} unknown surface forms in {corpus_file}")
+
+    profiling.count("lines", num_lines)
+    profiling.count("expression_matches", num_expression_matches)
+    profiling.count("time_matches", num_time_matches)
+    profiling.count("unknown_surface_forms", num_unknown)
+    return counts
 
 
 if __name__ == '__main__':
@@ -0,0 +1,67 @@
+import os
+import gzip
+import tqdm
+import json
+import argparse
+
+from src.common import profiling
+from src.common.time_expressions import compile_time_regex
+from src.extractive.corpus import CLOCK_TIME_BYTES, index_prefix, is_multistream
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--wiki_dir", default=".", type=str, required=False, help="Directory for the wiki files")
+    parser.add_argument("--lang", default="en", type=str, required=False, help="Language code")
+    parser.add_argument("--corpus_files", default=None, type=str, nargs="+", required=False,
+                        help="Corpus shards (gzip files). Default: {wiki_dir}/{lang}_wiki.tar.gz")
+    parser.add_argument("--index_dir", default=None, type=str, required=False,
+                        help="Where to save the index. Default: wiki_dir")
+    args = parser.parse_args()
+
+    if any(is_multistream(file) for file in args.corpus_files or []):
+        parser.error("Only gzip --corpus_files can be indexed, not bz2 multistream dumps")
+
+    report = profiling.start_run("index_time_lines", args.lang)
+
+    corpus_files = args.corpus_files or [f"{args.wiki_dir}/{args.lang}_wiki.tar.gz"]
+    index_dir = args.index_dir or args.wiki_dir
+    os.makedirs(index_dir, exist_ok=True)
+
+    with report.stage("index_time_lines"):
+        index_time_lines(corpus_files, index_prefix(index_dir, args.lang))
+
+    report.save(index_dir)
+
+
+def index_time_lines(corpus_files, prefix):
+    """
+    Saves the lines of the corpus files that contain a time to {prefix}.gz, which can be
+    scanned by find_time_expressions instead of the full corpus, since the other lines
+    don't contribute to the counts. {prefix}.json holds the list of shards and the number of lines.
+    """
+    time_regex = compile_time_regex()
+    num_lines, num_time_lines = 0, 0
+
+    with gzip.open(f"{prefix}.gz", "wb") as f_out:
+        for corpus_file in corpus_files:
+            with gzip.open(corpus_file, "r") as f_in:
+                for line in tqdm.tqdm(f_in):
+                    num_lines += 1
+
+                    # Lines with a clock time in ASCII digits match the time regex. Other lines
+                    # are only decoded if they have non-ASCII characters, which may be digits.
+                    if CLOCK_TIME_BYTES.search(line) or \
+                            (not line.isascii() and time_regex.search(line.decode("utf-8", errors="ignore"))):
+                        f_out.write(line if line.endswith(b"\n") else line + b"\n")
+                        num_time_lines += 1
+
+    with open(f"{prefix}.json", "w") as f_out:
+        json.dump({"corpus_files": corpus_files, "lines": num_lines, "time_lines": num_time_lines}, f_out)
+
+    profiling.count("lines", num_lines)
+    profiling.count("time_lines", num_time_lines)
+
+
+if __name__ == '__main__':
+    main()
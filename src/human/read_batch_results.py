@@ -6,12 +6,10 @@ import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
 
-from matplotlib.cm import get_cmap
-from matplotlib.patches import Patch
 from collections import Counter, defaultdict
-from matplotlib.collections import PolyCollection
 
 from src.common.times import to_24hr
+from src.plot_groundings import plot_by_exp
 
 pd.set_option('max_columns', None)
 logging.basicConfig(format='%(asctime)s - %(levelname)s - %(name)s - %(message)s', level=logging.INFO)
@@ -48,79 +46,6 @@ def main():
     plt.show()
 
 
-def plot_by_exp(ax, distribution):
-    """
-    Plot the distribution of times
-    """
-    expressions = ["morning", "noon", "afternoon", "evening", "night"]
-    countries = list(distribution.keys())
-
-    dist = {country:
-        {exp: {f"{edge}_{stat}": to_24hr(distribution[country][exp][f"{edge}_{stat}"])
-                  for edge in ["start", "end"] for stat in ["mean", "std"]}
-            for exp in expressions}
-            for country in countries}
-
-    for country in countries:
-        for edge in ["start", "end"]:
-            d = dist[country]["night"][f"{edge}_mean"]
-            dist[country]["night"][f"{edge}_mean"] = d + 24 if d < 12 else d
-
-    width = .1
-    verts = {country: [[
-        (dist[country][exp]["start_mean"], width * 2.1 * ctr_idx + exp_idx - width),
-        (dist[country][exp]["start_mean"], width * 2.1 * ctr_idx + exp_idx + width),
-        (dist[country][exp]["end_mean"], width * 2.1 * ctr_idx + exp_idx + width),
-        (dist[country][exp]["end_mean"], width * 2.1 * ctr_idx + exp_idx - width),
-        (dist[country][exp]["start_mean"], width * 2.1 * ctr_idx + exp_idx - width)]
-        for exp_idx, exp in enumerate(expressions)]
-        for ctr_idx, country in enumerate(countries)}
-
-    hatches = ['//', 'oo', 'xx', '..', '\\\\', '||', '--', '++', 'OO', '**']
-    hatches = {country: hatch for country, hatch in zip(countries, hatches)}
-    colors = {country: color for country, color in zip(countries, get_cmap("tab20").colors)}
-
-    for country, curr_verts in verts.items():
-        bars = PolyCollection(curr_verts, facecolors=colors[country], label=country)
-        ax.add_collection(bars)
-
-        # Add hatches
-        for vert in curr_verts:
-            ax.add_patch(plt.Polygon(vert, closed=True, fill=False, hatch=hatches[country]))
-
-        # Draw error bars
-        for exp_idx, exp in enumerate(expressions):
-            x_start = curr_verts[exp_idx][0][0]
-            x_end = curr_verts[exp_idx][2][0]
-            y = (curr_verts[exp_idx][0][1] + curr_verts[exp_idx][1][1]) / 2.0
-            start_std, end_std = dist[country][exp]["start_std"], dist[country][exp]["end_std"]
-            ax.plot([x_start - start_std / 2, x_start], [y, y], color="black", linestyle="solid", linewidth=.5)
-            ax.plot(x_start - start_std / 2, y, color="black", marker="|")
-            ax.plot([x_end, x_end + end_std / 2], [y, y], color="black", linestyle="solid", linewidth=.5)
-            ax.plot(x_end + end_std / 2, y, color="black", marker="|")
-
-    ax.autoscale()
-
-    # Set the times
-    ax.set_xticks(range(3, 39, 2))
-    ax.set_xlim([3, 38])
-    num_to_time = {12: "12pm", 24: "12am"}
-    num_to_time.update({i: f"{i}am" for i in range(1, 13)})
-    num_to_time.update({i: f"{i - 12}pm" for i in range(13, 25)})
-    num_to_time.update({i: f"{i - 24}am" for i in range(25, 37)})
-    num_to_time.update({i: f"{i - 36}pm" for i in range(37, 48)})
-    ax.set_xticklabels([num_to_time.get(num, "") for num in ax.get_xticks()], fontsize=10)
-
-    ax.set_yticks([i + len(countries) * width for i in range(len(expressions))])
-    ax.set_yticklabels(expressions, fontsize=10)
-
-    # Create the legend
-    legend_items = [Patch(
-        facecolor=colors[country], hatch=hatches[country], edgecolor="black",
-        label=country, ls="solid", lw=.5) for country in countries]
-    plt.legend(handles=legend_items, loc='upper left', fontsize=9, ncol=1)
-
-
 def correct_am_pm(curr_data, exp, edge):
     """
     Find annotations with obvious AM/PM mixup and fix them
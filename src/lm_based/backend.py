@@ -0,0 +1,197 @@
+import torch
+import logging
+import functools
+import multiprocessing
+
+from transformers import AutoTokenizer, AutoModelForMaskedLM
+
+from src.common import profiling
+
+logger = logging.getLogger(__name__)
+
+# The placeholder used in the template files
+TEMPLATE_MASK = "[MASK]"
+
+# The backend of the worker processes, inherited from the parent process when they are forked
+worker_backend = None
+
+
+class MaskedLMBackend:
+    """
+    Wraps any HuggingFace masked LM. Maps the template placeholder to the model's mask token
+    and scores candidate words at the mask position, including candidates that the tokenizer
+    splits into multiple subwords.
+    """
+    def __init__(self, model_name="bert-base-multilingual-cased", device=-1, quantize=False, batch_size=32,
+                 candidate_head=True):
+        self.model_name = model_name
+        self.quantized = quantize
+        self.batch_size = batch_size
+        self.candidate_head = candidate_head
+        self.device = torch.device("cpu" if device < 0 else f"cuda:{device}")
+
+        self.tokenizer = AutoTokenizer.from_pretrained(model_name)
+        self.model = AutoModelForMaskedLM.from_pretrained(model_name)
+        self.model.eval()
+
+        if quantize:
+            if device != -1:
+                raise ValueError("Dynamic quantization is only supported on CPU (device=-1)")
+
+            self.model = torch.quantization.quantize_dynamic(self.model, {torch.nn.Linear}, dtype=torch.qint8)
+
+        # Only project the mask positions onto the candidate rows of the output layer:
+        # the model returns the hidden states before the output layer.
+        if candidate_head:
+            self.output_layer = self.model.get_output_embeddings()
+            self.output_weight, self.output_bias = output_layer_params(self.output_layer)
+            self.model.set_output_embeddings(OutputLayerInput())
+
+        self.model.to(self.device)
+        self.mask_token = self.tokenizer.mask_token
+        self.mask_token_id = self.tokenizer.mask_token_id
+        self.candidate_ids = {}
+
+    def metadata(self):
+        """
+        Describes the model, to be saved along with the outputs
+        """
+        return {"model": self.model_name, "mask_token": self.mask_token, "quantized": self.quantized}
+
+    def format(self, template, num_masks=1):
+        """
+        Replace the template placeholder with the model's mask token(s)
+        """
+        return template.replace(TEMPLATE_MASK, self.mask_token * num_masks)
+
+    def resolve_candidates(self, candidates):
+        """
+        Returns the token IDs of each candidate word under this tokenizer. Candidates that the tokenizer
+        can't represent (with unknown tokens) have no IDs, so they are not scored.
+        """
+        for candidate in candidates:
+            if candidate not in self.candidate_ids:
+                ids = self.tokenizer(candidate, add_special_tokens=False)["input_ids"]
+
+                # Otherwise the candidate gets the probability of the unknown token
+                if self.tokenizer.unk_token_id is not None and self.tokenizer.unk_token_id in ids:
+                    logger.warning(f"Skipping the candidate {candidate}, which {self.model_name} can't tokenize")
+                    ids = []
+
+                self.candidate_ids[candidate] = ids
+
+        return {candidate: self.candidate_ids[candidate] for candidate in candidates}
+
+    def score(self, templates, candidates, normalize=True):
+        """
+        Returns the probability of each candidate at the mask position of each template.
+        A candidate with k subwords is scored with k consecutive masks as the product
+        of the subword probabilities. With normalize=False, the scores are only comparable
+        across the candidates of the same template, which saves computing the normalizer
+        over the full vocabulary when all the candidates have the same number of subwords.
+        """
+        candidate_ids = self.resolve_candidates(candidates)
+        scores = [{candidate: 0.0 for candidate in candidates} for _ in templates]
+        profiling.count("templates", len(templates))
+
+        # Group the candidates by the number of subwords, one forward pass per group
+        by_length = {}
+        for candidate, ids in candidate_ids.items():
+            if len(ids) > 0:
+                by_length.setdefault(len(ids), []).append(candidate)
+
+        normalize = normalize or len(by_length) > 1
+
+        for num_masks, curr_candidates in by_length.items():
+            texts = [self.format(template, num_masks) for template in templates]
+            ids = torch.tensor([candidate_ids[candidate] for candidate in curr_candidates])
+
+            for start in range(0, len(texts), self.batch_size):
+                log_probs = self.candidate_log_probs(texts[start:start + self.batch_size], ids, normalize)
+
+                # (batch, candidates, num_masks) -> (batch, candidates)
+                log_probs = log_probs.sum(dim=-1)
+                if not normalize:
+                    log_probs = log_probs - log_probs.max(dim=1, keepdim=True).values
+
+                for i, per_template in enumerate(log_probs.exp().tolist()):
+                    scores[start + i].update(zip(curr_candidates, per_template))
+
+        return scores
+
+    @torch.no_grad()
+    def candidate_log_probs(self, texts, ids, normalize=True):
+        """
+        Returns a (batch, candidates, num_masks) tensor with the log probability of each
+        candidate subword (ids is a (candidates, num_masks) tensor) at the mask positions
+        """
+        num_masks = ids.shape[1]
+        inputs = self.tokenizer(texts, padding=True, return_tensors="pt").to(self.device)
+        profiling.count("forward_passes")
+        profiling.observe("batch_size", len(texts))
+        outputs = self.model(**inputs).logits
+        mask_outputs = outputs[inputs["input_ids"] == self.mask_token_id].view(len(texts), num_masks, -1)
+
+        if not self.candidate_head:
+            log_probs = torch.log_softmax(mask_outputs, dim=-1)
+            return log_probs[:, torch.arange(num_masks), ids].cpu()
+
+        # Project the mask hidden states onto the candidate rows only
+        ids = ids.to(self.device)
+        logits = torch.einsum("blh,clh->bcl", mask_outputs, self.output_weight[ids]) + self.output_bias[ids]
+
+        # The normalizer over the full vocabulary, computed once per mask position
+        if normalize:
+            logits = logits - torch.logsumexp(self.output_layer(mask_outputs), dim=-1).unsqueeze(1)
+
+        return logits.cpu()
+
+
+def map_shared(backend, fn, items, num_workers=1):
+    """
+    Returns [fn(backend, item) for item in items]. With num_workers > 1, the items are distributed
+    between forked worker processes that share the weights of the backend instead of loading their own
+    copy. The intra-op threads are divided between the workers.
+    """
+    if num_workers <= 1:
+        return [fn(backend, item) for item in items]
+
+    if backend.device.type != "cpu":
+        raise ValueError("Multiple workers are only supported on CPU (device=-1)")
+
+    # The forked workers read the weights of the parent process (copy-on-write), without copying them
+    global worker_backend
+    worker_backend = backend
+    num_threads = max(torch.get_num_threads() // num_workers, 1)
+
+    with multiprocessing.get_context("fork").Pool(num_workers, initializer=init_worker, initargs=(num_threads,)) as pool:
+        return pool.map(functools.partial(call_with_backend, fn), items, chunksize=1)
+
+
+def init_worker(num_threads):
+    torch.set_num_threads(num_threads)
+    torch.set_grad_enabled(False)
+
+
+def call_with_backend(fn, item):
+    return fn(worker_backend, item)
+
+
+class OutputLayerInput(torch.nn.Identity):
+    """
+    Replaces the output layer, so that the model returns its input hidden states
+    """
+    bias = None
+
+
+def output_layer_params(output_layer):
+    """
+    Returns the weight and bias of the output layer (vocab x hidden, vocab)
+    """
+    weight, bias = output_layer.weight, output_layer.bias
+
+    # Dynamically quantized linear layer
+    if callable(weight):
+        weight, bias = weight().dequantize(), bias()
+
+    return weight.detach(), bias.detach()
@@ -1,76 +1,298 @@
+import os
+import json
 import numpy as np
 
+from src.common import profiling
+from src.common.outputs import load_output
+from src.lm_based.backend import TEMPLATE_MASK
 
-def compute_distribution(unmasker, templates, numbers_map, time_expressions_map, ampm_map=None):
+
+def load_language_data(lang):
+    """
+    Loads the numbers map, time expressions and (for languages with a 12hr clock) AM/PM map of a language
+    """
+    numbers_map, ampm_map = load_numbers(lang)
+    return numbers_map, load_time_expressions_map(lang), ampm_map
+
+
+def load_numbers(lang):
     """
-    Uses multilingual BERT to find the distribution of 12-hr clock hours for each time expression.
+    Returns the numbers map and, for languages with a 12hr clock, the AM/PM map of a language.
+    Languages without an AM/PM map use the 24hr clock.
+    """
+    ampm_map = None
+
+    # This language uses 12hr clock
+    if os.path.exists(f"data/ampm/{lang}.json"):
+        ampm_map = json.load(open(f"data/ampm/{lang}.json"))
+        max_num = 12
+    else:
+        max_num = 23
+
+    # Build the numbers map
+    numbers_map = {str(num): num for num in range(0, max_num + 1)}
+    numbers_map.update({"0" + str(num): num for num in range(0, 10)})
+    return numbers_map, ampm_map
+
+
+def load_time_expressions_map(lang):
+    """
+    Returns the surface forms of each time expression: {English label: [surface forms]}
+    """
+    time_expressions = [line.strip().split("\t") for line in open(f"data/time_expressions/{lang}.txt")]
+    return {en: other.split("|") for en, other in time_expressions}
+
+
+def load_templates(lang, kind="distribution"):
+    """
+    Loads the templates with the mask placeholder: a list for kind="distribution"
+    and a dictionary of edge (start/end) to list for kind="start_end"
+    """
+    if kind == "distribution":
+        templates = [line.strip() for line in open(f"data/templates/distribution/{lang}.txt")]
+        return [template for template in templates if TEMPLATE_MASK in template]
+
+    templates = json.load(open(f"data/templates/start_end/{lang}.json"))
+    return {edge: [template for template in curr_templates if TEMPLATE_MASK in template]
+            for edge, curr_templates in templates.items()}
+
+
+def compute_distribution(backend, templates, numbers_map, time_expressions_map, ampm_map=None,
+                         kl_threshold=None, min_templates=16, chunk_size=8, seed=0, stats=None):
+    """
+    Uses a masked LM to find the distribution of 12-hr clock hours for each time expression.
+    If kl_threshold is specified, the templates of each expression are evaluated in a random order,
+    chunk_size at a time, until at least min_templates were used and the KL divergence between
+    successive estimates of the distribution is below kl_threshold. The number of templates used
+    and the last KL divergence of each expression are added to stats.
     """
     distributions = {}
 
     # Allow for various time formats: 9:00, 9.00, 9h00, and 9.
-    templates += [t.replace("[MASK]", "[MASK]:00") for t in templates] + \
-                 [t.replace("[MASK]", "[MASK].00") for t in templates] + \
-                 [t.replace("[MASK]", "[MASK]h00") for t in templates]
+    templates += [t.replace(TEMPLATE_MASK, f"{TEMPLATE_MASK}:00") for t in templates] + \
+                 [t.replace(TEMPLATE_MASK, f"{TEMPLATE_MASK}.00") for t in templates] + \
+                 [t.replace(TEMPLATE_MASK, f"{TEMPLATE_MASK}h00") for t in templates]
 
     for en_exp, target_exps in time_expressions_map.items():
         # Create the templates
         curr_templates = [t.replace("<time_exp>", exp) for exp in target_exps for t in templates]
 
-        # Initialize the distribution
-        distribution = {i: 0 for i in numbers_map.values()}
-        if ampm_map is not None:
-            distribution = {i: 0 for i in range(0, 24)}
-
         # Go over all the templates
-        for template in curr_templates:
-            curr_distribution = unmask(
-                unmasker, template, list(numbers_map.keys()),
-                lambda num: numbers_map.get(num, None))
-
-            # If we also need to predict AM/PM
-            if ampm_map is not None:
-                for i in curr_distribution.keys():
-                    curr_template = template.replace("[MASK]:00", f"{i:02d}:00 [MASK]")
-                    ampm_inverse_map = {v: k for k, vals in ampm_map.items() for v in vals}
-
-                    am_pm = unmask(
-                        unmasker, curr_template, [v for vals in ampm_map.values() for v in vals],
-                        lambda x: x if x in ampm_inverse_map.keys() else None)
-
-                    for k, v in ampm_inverse_map.items():
-                        if v == "am":
-                            distribution[i] += curr_distribution[i] * am_pm[k]
-                        else:
-                            distribution[(i+12)%24] += curr_distribution[i] * am_pm[k]
-            else:
-                for i in curr_distribution.keys():
-                    distribution[i] += curr_distribution[i]
+        if kl_threshold is None:
+            distribution = template_contributions(backend, curr_templates, numbers_map, ampm_map).sum(axis=0)
+            num_used, kl = len(curr_templates), None
+
+        # Stop when the distribution converges
+        else:
+            rnd = np.random.RandomState(seed)
+            order = rnd.permutation(len(curr_templates))
+            distribution, prev, num_used, kl = np.zeros(24), None, 0, None
+
+            for start in range(0, len(order), chunk_size):
+                chunk = [curr_templates[i] for i in order[start:start + chunk_size]]
+                distribution += template_contributions(backend, chunk, numbers_map, ampm_map).sum(axis=0)
+                num_used += len(chunk)
+
+                curr = distribution / distribution.sum()
+                if prev is not None:
+                    kl = kl_divergence(curr, prev)
+
+                prev = curr
+                if num_used >= min_templates and kl is not None and kl < kl_threshold:
+                    break
+
+            profiling.observe("final_kl", kl if kl is not None else 0.0)
+
+        profiling.count("templates_used", num_used)
+        profiling.count("templates_total", len(curr_templates))
+        if stats is not None:
+            stats[en_exp] = {"templates": num_used, "total_templates": len(curr_templates), "kl": kl}
 
         # Normalize and add to the result
-        all_sum = np.sum(list(distribution.values()))
-        distribution = {i: score * 1.0 / all_sum for i, score in distribution.items()}
-        distributions[en_exp] = distribution
+        all_sum = np.sum(distribution)
+        distributions[en_exp] = {i: score * 1.0 / all_sum for i, score in enumerate(distribution.tolist())}
 
     return distributions
 
 
-def unmask(unmasker, template, values_to_consider, val_map_fn):
+def template_contributions(backend, templates, numbers_map, ampm_map=None):
+    """
+    Returns a (templates x 24) matrix with the contribution of each template to the
+    (unnormalized) hour distribution
+    """
+    contributions = np.zeros((len(templates), 24))
+
+    hour_distributions = unmask(
+        backend, templates, list(numbers_map.keys()),
+        lambda num: numbers_map.get(num, None))
+
+    # If we also need to predict AM/PM
+    if ampm_map is not None:
+        ampm_inverse_map = {v: k for k, vals in ampm_map.items() for v in vals}
+        ampm_templates = [template.replace(f"{TEMPLATE_MASK}:00", f"{i:02d}:00 {TEMPLATE_MASK}")
+                          for template, curr_distribution in zip(templates, hour_distributions)
+                          for i in curr_distribution.keys()]
+
+        am_pm_distributions = iter(unmask(
+            backend, ampm_templates, [v for vals in ampm_map.values() for v in vals],
+            lambda x: x if x in ampm_inverse_map.keys() else None))
+
+        for t, curr_distribution in enumerate(hour_distributions):
+            for i in curr_distribution.keys():
+                am_pm = next(am_pm_distributions)
+
+                for k, v in ampm_inverse_map.items():
+                    if v == "am":
+                        contributions[t, i] += curr_distribution[i] * am_pm[k]
+                    else:
+                        contributions[t, (i+12)%24] += curr_distribution[i] * am_pm[k]
+    else:
+        for t, curr_distribution in enumerate(hour_distributions):
+            for i in curr_distribution.keys():
+                contributions[t, i] += curr_distribution[i]
+
+    return contributions
+
+
+def kl_divergence(p, q, eps=1e-12):
     """
-    Returns the distribution over numbers for a single template
+    KL(p || q) of two (unnormalized) distributions
     """
-    res = unmasker(template, top_k=500)
-    dist = {val_map_fn(i): 0 for i in values_to_consider}
+    p, q = np.asarray(p, dtype=float) + eps, np.asarray(q, dtype=float) + eps
+    p, q = p / p.sum(), q / q.sum()
+    return float(np.sum(p * np.log(p / q)))
 
-    # Check if it's a number and add to distribution
-    for item in res:
-        num = val_map_fn(item["token_str"])
-        if num is not None:
-            dist[num] += item["score"]
 
-    # Normalize and add to main distribution
-    all_sum = np.sum(list(dist.values()))
+def unmask(backend, templates, values_to_consider, val_map_fn):
+    """
+    Returns the distribution over numbers for each template
+    """
+    dists = []
+
+    # The scores are normalized over the values below, so the full vocabulary normalizer is not needed
+    for scores in backend.score(templates, values_to_consider, normalize=False):
+        dist = {val_map_fn(i): 0 for i in values_to_consider}
+
+        # Add the score of each candidate to its value
+        for candidate, score in scores.items():
+            dist[val_map_fn(candidate)] += score
+
+        # Normalize and add to main distribution
+        all_sum = np.sum(list(dist.values()))
+
+        if all_sum > 0:
+            dist = {i: score * 1.0 / all_sum for i, score in dist.items()}
+
+        dists.append(dist)
+
+    return dists
+
+
+def compare_distributions(reference, distributions, eps=1e-12):
+    """
+    Compares hour distributions ({exp: {hour: score}}) against a reference run:
+    KL(reference || distributions) and whether the most likely hour agrees.
+    """
+    report = {}
+    for exp, ref_dist in reference.items():
+        if exp not in distributions:
+            continue
+
+        # Keys are strings when the reference is loaded from a json file
+        curr_dist = {str(h): score for h, score in distributions[exp].items()}
+        hours = [str(h) for h in ref_dist.keys() if h not in {"start", "end"}]
+        ref_dist = {str(h): score for h, score in ref_dist.items()}
+        p = np.array([ref_dist[h] for h in hours], dtype=float)
+        q = np.array([curr_dist.get(h, 0) for h in hours], dtype=float)
+
+        report[exp] = {"kl": kl_divergence(p, q, eps),
+                       "argmax_agreement": bool(np.argmax(p) == np.argmax(q))}
+
+    return report
+
+
+def compare_hours(reference, hours):
+    """
+    Compares solved start or end hours ({exp: hour}) against a reference run:
+    the difference in hours (around the clock) and whether the hours agree.
+    """
+    report = {}
+    for exp, ref_hour in reference.items():
+        if exp not in hours:
+            continue
 
-    if all_sum > 0:
-        dist = {i: score * 1.0 / all_sum for i, score in dist.items()}
+        # The solver returns the hours as floats
+        ref_hour, hour = int(round(ref_hour)) % 24, int(round(hours[exp])) % 24
+        difference = min(abs(hour - ref_hour), 24 - abs(hour - ref_hour))
+        report[exp] = {"reference_hour": ref_hour, "hour": hour, "difference": difference,
+                       "agreement": difference == 0}
+
+    return report
+
+
+def write_comparison_report(reference_file, grounding, out_file, model, edges=None, solve=None):
+    """
+    Compares the (quantized or adaptive) grounding to the fp32 exhaustive grounding in reference_file
+    and saves the per-expression report. The metadata of the reference must show that it was computed
+    by the same model, without quantization and with all the templates. For start/end groundings, edges
+    is ["start", "end"] and each edge is compared separately. When the solver already replaced the reference
+    distributions with the start and end hours, the grounding is solved with solve(grounding) and the hours
+    are compared.
+    """
+    reference = load_output(reference_file)
+    if reference is None:
+        print(f"Reference file {reference_file} not found or empty, skipping the comparison report")
+        return None
+
+    # Otherwise the differences aren't only due to the quantization or the adaptive evaluation
+    meta_file = reference_file.replace(".json", "_meta.json")
+    reference_metadata = load_output(meta_file)
+    if reference_metadata is None or reference_metadata.get("model") != model or \
+            reference_metadata.get("quantized", True) or "adaptive" in reference_metadata:
+        print(f"Warning: {meta_file} doesn't show an fp32 exhaustive run of {model}, skipping the comparison report")
+        return None
+
+    if edges is None:
+        report = compare_distributions(reference, grounding)
+    else:
+        report, solved = {}, None
+        for edge in edges:
+            ref_edge = {exp: per_exp[edge] for exp, per_exp in reference.items() if edge in per_exp}
+
+            if all(isinstance(value, dict) for value in ref_edge.values()):
+                report[edge] = compare_distributions(
+                    ref_edge, {exp: per_exp[edge] for exp, per_exp in grounding.items()})
+                continue
+
+            # The solver replaced the reference distributions with the chosen hours
+            if solve is None:
+                print(f"{reference_file} holds solved hours, skipping the comparison report")
+                return None
+
+            solved = solved or solve(grounding)
+            if solved is None:
+                print("Could not solve the start and end hours, skipping the comparison report")
+                return None
+
+            report[edge] = compare_hours(ref_edge, {exp: per_exp[edge] for exp, per_exp in solved.items()})
+
+    if all(len(per_edge) == 0 for per_edge in (report.values() if edges is not None else [report])):
+        print(f"No expressions in common with {reference_file}, skipping the comparison report")
+        return None
+
+    with open(out_file, "w") as f_out:
+        json.dump(report, f_out)
+
+    return report
+
+
+def metadata(backend, args, stats):
+    """
+    The metadata saved next to the outputs: the model and, in the adaptive mode, the templates used
+    """
+    curr_metadata = backend.metadata()
+    if args.kl_threshold is not None:
+        curr_metadata["adaptive"] = {"kl_threshold": args.kl_threshold, "min_templates": args.min_templates,
+                                     "seed": args.seed, "expressions": stats}
 
-    return dist
\ No newline at end of file
+    return curr_metadata
@@ -1,10 +1,12 @@
 import os
 import json
 import argparse
+import numpy as np
 
-from transformers import pipeline
-
-from src.lm_based.common import compute_distribution
+from src.common import profiling
+from src.lm_based.backend import MaskedLMBackend, map_shared
+from src.lm_based.common import compute_distribution, load_language_data, load_templates, \
+    write_comparison_report, metadata
 
 
 def main():
@@ -13,10 +15,35 @@ def main():
     parser.add_argument("--device", default=-1, type=int, required=False, help="GPU device or -1 for CPU")
     parser.add_argument("--lang", default=None, type=str, required=False,
                         help="Language code. If not specified, computes for all")
+    parser.add_argument("--model", default="bert-base-multilingual-cased", type=str, required=False,
+                        help="HuggingFace masked LM")
+    parser.add_argument("--batch_size", default=32, type=int, required=False, help="Templates per forward pass")
+    parser.add_argument("--quantize", action="store_true",
+                        help="Apply dynamic int8 quantization to the linear layers (CPU only)")
+    parser.add_argument("--reference_dir", default="output/lm_based", type=str, required=False,
+                        help="Directory with the fp32 exhaustive outputs to compare the quantized or adaptive outputs to")
+    parser.add_argument("--kl_threshold", default=None, type=float, required=False,
+                        help="Evaluate the templates in a random order and stop when the KL divergence between "
+                             "successive estimates of each distribution is below this threshold")
+    parser.add_argument("--min_templates", default=16, type=int, required=False,
+                        help="Minimum number of templates per expression with --kl_threshold")
+    parser.add_argument("--seed", default=0, type=int, required=False, help="Random seed for the template order")
+    parser.add_argument("--profile", action="store_true", help="Save cProfile stats next to the run reports")
+    parser.add_argument("--num_workers", default=1, type=int, required=False,
+                        help="Number of languages to compute in parallel on CPU. The workers share the model weights")
     args = parser.parse_args()
 
-    # Load multilingual BERT
-    unmasker = pipeline('fill-mask', model='bert-base-multilingual-cased', device=args.device)
+    # The reference outputs would be overwritten
+    if (args.quantize or args.kl_threshold is not None) and \
+            os.path.abspath(args.out_dir) == os.path.abspath(args.reference_dir):
+        parser.error("--out_dir must be different from --reference_dir with --quantize or --kl_threshold")
+
+    # Load the masked LM
+    run_report = profiling.start_run("extract_distribution_from_lm", "all")
+    with run_report.stage("load_model"):
+        backend = MaskedLMBackend(args.model, device=args.device, quantize=args.quantize, batch_size=args.batch_size)
+
+    run_report.save(args.out_dir)
 
     # Iterate over languages
     if args.lang is not None:
@@ -24,36 +51,49 @@ def main():
     else:
         langs = [file.replace(".txt", "") for file in os.listdir("data/templates/distribution")]
 
-    for lang in langs:
-        print(lang)
-        templates = [line.strip() for line in open(f"data/templates/distribution/{lang}.txt")]
-        templates = [template for template in templates if "[MASK]" in template]
-        ampm_map = None
-
-        # This language uses 12hr clock
-        if os.path.exists(f"data/ampm/{lang}.json"):
-            ampm_map = json.load(open(f"data/ampm/{lang}.json"))
-            max_num = 12
-        else:
-            max_num = 23
+    # The workers share the weights of the model loaded above
+    map_shared(backend, extract_language, [(lang, args) for lang in langs], args.num_workers)
 
-        # Build the numbers map
-        numbers_map = {str(num): num for num in range(0, max_num + 1)}
-        numbers_map.update({"0" + str(num): num for num in range(0, 10)})
 
-        time_expressions = [line.strip().split("\t") for line in open(f"data/time_expressions/{lang}.txt")]
-        time_expressions_map = {en: other.split("|") for en, other in time_expressions}
+def extract_language(backend, task):
+    """
+    Computes and saves the distribution of one language (in a worker process with --num_workers)
+    """
+    lang, args = task
+    print(lang)
+    run_report = profiling.start_run("extract_distribution_from_lm", lang)
+    stats = {}
+    templates = load_templates(lang, "distribution")
+    numbers_map, time_expressions_map, ampm_map = load_language_data(lang)
 
-        # Compute the distribution
-        try:
+    # Compute the distribution
+    try:
+        profile_path = profiling.report_path(args.out_dir, run_report.script, lang, "prof")
+        with profiling.profile(profile_path, args.profile), run_report.stage("compute_distribution"):
             grounding = compute_distribution(
-                unmasker, templates, numbers_map, time_expressions_map, ampm_map)
-        except:
-            print(templates)
-            continue
+                backend, templates, numbers_map, time_expressions_map, ampm_map, args.kl_threshold,
+                args.min_templates, seed=args.seed, stats=stats)
+    except:
+        print(templates)
+        return
+
+    # Compare to the fp32 exhaustive distributions
+    if args.quantize or args.kl_threshold is not None:
+        report = write_comparison_report(
+            f"{args.reference_dir}/{lang}_24.json", grounding,
+            f"{args.out_dir}/{lang}_24_{'quantization' if args.quantize else 'adaptive'}.json", args.model)
+
+        if report:
+            print(f"KL: {np.mean([r['kl'] for r in report.values()]):.4f}, "
+                  f"argmax agreement: {np.mean([r['argmax_agreement'] for r in report.values()]):.2f}")
+
+    with open(f"{args.out_dir}/{lang}_24.json", "w") as f_out:
+        json.dump(grounding, f_out)
+
+    with open(f"{args.out_dir}/{lang}_24_meta.json", "w") as f_out:
+        json.dump(metadata(backend, args, stats), f_out)
 
-        with open(f"{args.out_dir}/{lang}_24.json", "w") as f_out:
-            json.dump(grounding, f_out)
+    run_report.save(args.out_dir)
 
 
 if __name__ == '__main__':
@@ -1,9 +1,12 @@
 import os
 import json
 import argparse
+import numpy as np
 
-from transformers import pipeline
-from src.lm_based.common import compute_distribution
+from src.common import profiling
+from src.lm_based.backend import MaskedLMBackend, map_shared
+from src.lm_based.common import compute_distribution, load_language_data, load_templates, \
+    write_comparison_report, metadata
 
 
 def main():
@@ -12,10 +15,35 @@ def main():
     parser.add_argument("--device", default=-1, type=int, required=False, help="GPU device or -1 for CPU")
     parser.add_argument("--lang", default=None, type=str, required=False,
                         help="Language code. If not specified, computes for all")
+    parser.add_argument("--model", default="bert-base-multilingual-cased", type=str, required=False,
+                        help="HuggingFace masked LM")
+    parser.add_argument("--batch_size", default=32, type=int, required=False, help="Templates per forward pass")
+    parser.add_argument("--quantize", action="store_true",
+                        help="Apply dynamic int8 quantization to the linear layers (CPU only)")
+    parser.add_argument("--reference_dir", default="output/lm_based", type=str, required=False,
+                        help="Directory with the fp32 exhaustive outputs to compare the quantized or adaptive outputs to")
+    parser.add_argument("--kl_threshold", default=None, type=float, required=False,
+                        help="Evaluate the templates in a random order and stop when the KL divergence between "
+                             "successive estimates of each distribution is below this threshold")
+    parser.add_argument("--min_templates", default=16, type=int, required=False,
+                        help="Minimum number of templates per expression with --kl_threshold")
+    parser.add_argument("--seed", default=0, type=int, required=False, help="Random seed for the template order")
+    parser.add_argument("--profile", action="store_true", help="Save cProfile stats next to the run reports")
+    parser.add_argument("--num_workers", default=1, type=int, required=False,
+                        help="Number of languages to compute in parallel on CPU. The workers share the model weights")
     args = parser.parse_args()
 
-    # Load multilingual BERT
-    unmasker = pipeline('fill-mask', model='bert-base-multilingual-cased', device=args.device)
+    # The reference outputs would be overwritten
+    if (args.quantize or args.kl_threshold is not None) and \
+            os.path.abspath(args.out_dir) == os.path.abspath(args.reference_dir):
+        parser.error("--out_dir must be different from --reference_dir with --quantize or --kl_threshold")
+
+    # Load the masked LM
+    run_report = profiling.start_run("extract_start_end_from_lm", "all")
+    with run_report.stage("load_model"):
+        backend = MaskedLMBackend(args.model, device=args.device, quantize=args.quantize, batch_size=args.batch_size)
+
+    run_report.save(args.out_dir)
 
     # Iterate over languages
     if args.lang is not None:
@@ -23,38 +51,70 @@ def main():
     else:
         langs = [file.replace(".txt", "") for file in os.listdir("data/templates/distribution")]
 
-    # Iterate over languages
-    for lang in langs:
-        print(lang)
-        templates = json.load(open(f"data/templates/start_end/{lang}.json"))
-        templates = {edge: [template for template in curr_templates if "[MASK]" in template]
-                     for edge, curr_templates in templates.items()}
-        ampm_map = None
-
-        # This language uses 12hr clock
-        if os.path.exists(f"data/ampm/{lang}.json"):
-            ampm_map = json.load(open(f"data/ampm/{lang}.json"))
-            max_num = 12
-        else:
-            max_num = 23
-
-        # Build the numbers map
-        numbers_map = {str(num): num for num in range(0, max_num + 1)}
-        numbers_map.update({"0" + str(num): num for num in range(0, 10)})
-
-        time_expressions = [line.strip().split("\t") for line in open(f"data/time_expressions/{lang}.txt")]
-        time_expressions_map = {en: other.split("|") for en, other in time_expressions}
-
-        # Compute the distribution
-        grounding = {}
+    # The workers share the weights of the model loaded above
+    map_shared(backend, extract_language, [(lang, args) for lang in langs], args.num_workers)
+
+
+def extract_language(backend, task):
+    """
+    Computes and saves the start and end distributions of one language (in a worker process with --num_workers)
+    """
+    lang, args = task
+    print(lang)
+    run_report = profiling.start_run("extract_start_end_from_lm", lang)
+    stats = {}
+    templates = load_templates(lang, "start_end")
+    numbers_map, time_expressions_map, ampm_map = load_language_data(lang)
+
+    # Compute the distribution
+    grounding = {}
+    profile_path = profiling.report_path(args.out_dir, run_report.script, lang, "prof")
+    with profiling.profile(profile_path, args.profile):
         for edge, curr_templates in templates.items():
-            grounding[edge] = compute_distribution(
-                unmasker, curr_templates, numbers_map, time_expressions_map, ampm_map)
+            with run_report.stage(f"compute_distribution_{edge}"):
+                grounding[edge] = compute_distribution(
+                    backend, curr_templates, numbers_map, time_expressions_map, ampm_map, args.kl_threshold,
+                    args.min_templates, seed=args.seed, stats=stats.setdefault(edge, {}))
+
+    grounding = {exp: {edge: grounding[edge][exp] for edge in ["start", "end"]} for exp in grounding["end"].keys()}
+
+    # Compare to the fp32 exhaustive distributions
+    if args.quantize or args.kl_threshold is not None:
+        report = write_comparison_report(
+            f"{args.reference_dir}/{lang}_start_end.json", grounding,
+            f"{args.out_dir}/{lang}_start_end_{'quantization' if args.quantize else 'adaptive'}.json", args.model,
+            edges=["start", "end"],
+            solve=lambda curr_grounding: solve_start_end(curr_grounding, lang, args.out_dir))
+
+        if report:
+            for edge, per_edge in report.items():
+                if len(per_edge) == 0:
+                    continue
+
+                if "kl" in next(iter(per_edge.values())):
+                    print(f"{edge} KL: {np.mean([r['kl'] for r in per_edge.values()]):.4f}, "
+                          f"argmax agreement: {np.mean([r['argmax_agreement'] for r in per_edge.values()]):.2f}")
+                else:
+                    print(f"{edge} hour difference: {np.mean([r['difference'] for r in per_edge.values()]):.2f}, "
+                          f"agreement: {np.mean([r['agreement'] for r in per_edge.values()]):.2f}")
+
+    with open(f"{args.out_dir}/{lang}_start_end.json", "w") as f_out:
+        json.dump(grounding, f_out)
+
+    with open(f"{args.out_dir}/{lang}_start_end_meta.json", "w") as f_out:
+        json.dump(metadata(backend, args, stats), f_out)
+
+    run_report.save(args.out_dir)
+
 
-        grounding = {exp: {edge: grounding[edge][exp] for edge in ["start", "end"]} for exp in grounding["end"].keys()}
+def solve_start_end(grounding, lang, out_dir):
+    """
+    Solves the start and end hours, to compare them to a solved reference
+    """
+    # The solver requires gurobipy, which the extraction doesn't
+    from src.compute_start_end_from_start_end_dist import solve_grounding
 
-        with open(f"{args.out_dir}/{lang}_start_end.json", "w") as f_out:
-            json.dump(grounding, f_out)
+    return solve_grounding(grounding, lang, iis_file=f"{out_dir}/{lang}_start_end_iis.ilp")[1]
 
 
 if __name__ == '__main__':
@@ -6,15 +6,7 @@ declare -a langs=("en" "fr" "de" "es" "ja" "ru" "it" "zh" "pt" "ar" "fa" "pl" "n
 python -m src.lm_based.extract_distribution_from_lm --device ${device};
 python -m src.lm_based.extract_start_end_from_lm --device ${device};
 
-for lang in "${langs[@]}"
-do
-  python -m src.compute_start_end_for_24h_clock --lang ${lang} --out_dir output/lm_based;
-  python -m src.compute_start_end_from_start_end_dist --lang ${lang} --out_dir output/lm_based;
-done
-
-
-
-for lang in "${langs[@]}"
-do
-  python -m src.compute_start_end_from_start_end_dist --lang ${lang} --out_dir output/lm_based;
-done
\ No newline at end of file
+# One process per solver, reusing the ILP model across languages
+all_langs=$(IFS=,; echo "${langs[*]}")
+python -m src.compute_start_end_for_24h_clock --langs ${all_langs} --out_dir output/lm_based;
+python -m src.compute_start_end_from_start_end_dist --langs ${all_langs} --out_dir output/lm_based;
\ No newline at end of file
@@ -0,0 +1,69 @@
+import json
+import time
+import argparse
+import numpy as np
+import urllib.request
+
+from concurrent.futures import ThreadPoolExecutor
+
+from src.lm_based.common import load_templates
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--url", default="http://127.0.0.1:8000", type=str, required=False, help="Server URL")
+    parser.add_argument("--langs", default="en,de,ja,hi", type=str, required=False,
+                        help="Comma-separated language codes to request")
+    parser.add_argument("--kind", default="distribution", type=str, required=False, help="distribution or start_end")
+    parser.add_argument("--concurrency", default=8, type=int, required=False, help="Number of concurrent callers")
+    parser.add_argument("--num_templates", default=None, type=int, required=False,
+                        help="Only send the first templates of each language, as in interactive exploration")
+    parser.add_argument("--num_requests", default=32, type=int, required=False, help="Total number of requests")
+    args = parser.parse_args()
+
+    langs = args.langs.split(",")
+    requests = [{"lang": langs[i % len(langs)], "kind": args.kind} for i in range(args.num_requests)]
+
+    if args.num_templates is not None:
+        for request in requests:
+            templates = load_templates(request["lang"], args.kind)
+            if args.kind == "distribution":
+                request["templates"] = templates[:args.num_templates]
+            else:
+                request["templates"] = {edge: curr[:args.num_templates] for edge, curr in templates.items()}
+
+    def timed_request(request):
+        start = time.perf_counter()
+        request_distribution(args.url, **request)
+        return time.perf_counter() - start
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(args.concurrency) as executor:
+        latencies = list(executor.map(timed_request, requests))
+
+    total = time.perf_counter() - start
+    print(f"{args.num_requests} requests with {args.concurrency} concurrent callers in {total:.2f}s: "
+          f"{args.num_requests / total:.2f} requests/s, latency p50={np.percentile(latencies, 50):.3f}s "
+          f"p95={np.percentile(latencies, 95):.3f}s")
+
+
+def request_distribution(url, lang, kind="distribution", templates=None, expressions=None):
+    """
+    Requests the distributions of a language from the server (src.lm_based.serve)
+    """
+    request = {"lang": lang, "kind": kind}
+    if templates is not None:
+        request["templates"] = templates
+    if expressions is not None:
+        request["expressions"] = expressions
+
+    http_request = urllib.request.Request(
+        f"{url}/distribution", data=json.dumps(request).encode("utf-8"),
+        headers={"Content-Type": "application/json"})
+
+    with urllib.request.urlopen(http_request) as response:
+        return json.loads(response.read().decode("utf-8"))["grounding"]
+
+
+if __name__ == '__main__':
+    main()
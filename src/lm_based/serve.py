@@ -0,0 +1,235 @@
+import re
+import json
+import time
+import queue
+import logging
+import argparse
+import threading
+
+from concurrent.futures import Future
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+from src.lm_based.backend import MaskedLMBackend, TEMPLATE_MASK
+from src.lm_based.common import compute_distribution, load_numbers, load_templates, load_time_expressions_map
+
+logging.basicConfig(format='%(asctime)s - %(levelname)s - %(name)s - %(message)s', level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--device", default=-1, type=int, required=False, help="GPU device or -1 for CPU")
+    parser.add_argument("--model", default="bert-base-multilingual-cased", type=str, required=False,
+                        help="HuggingFace masked LM")
+    parser.add_argument("--quantize", action="store_true",
+                        help="Apply dynamic int8 quantization to the linear layers (CPU only)")
+    parser.add_argument("--host", default="127.0.0.1", type=str, required=False, help="Host to listen on")
+    parser.add_argument("--port", default=8000, type=int, required=False, help="Port to listen on")
+    parser.add_argument("--max_batch_size", default=64, type=int, required=False,
+                        help="Maximum number of templates per forward pass")
+    parser.add_argument("--max_latency_ms", default=10.0, type=float, required=False,
+                        help="How long to wait for more requests before running a batch")
+    args = parser.parse_args()
+
+    # Load the masked LM once and keep it in memory
+    backend = MaskedLMBackend(args.model, device=args.device, quantize=args.quantize, batch_size=args.max_batch_size)
+    batching_backend = BatchingBackend(backend, args.max_batch_size, args.max_latency_ms / 1000.0)
+
+    server = ThreadingHTTPServer((args.host, args.port), DistributionHandler)
+    server.backend = batching_backend
+    logger.info(f"Serving {args.model} on http://{args.host}:{args.port}")
+
+    try:
+        server.serve_forever()
+    finally:
+        batching_backend.close()
+
+
+class BatchingBackend:
+    """
+    Exposes the score() method of MaskedLMBackend to multiple threads. Concurrent calls with the same
+    candidates are coalesced into a single batch, which runs once it has max_batch_size templates
+    or when max_latency seconds have passed since its first call.
+    """
+    def __init__(self, backend, max_batch_size=64, max_latency=0.01):
+        self.backend = backend
+        self.max_batch_size = max_batch_size
+        self.max_latency = max_latency
+        self.requests = queue.Queue()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def metadata(self):
+        return self.backend.metadata()
+
+    def score(self, templates, candidates, normalize=True):
+        """
+        Same as MaskedLMBackend.score(), called from the request threads
+        """
+        future = Future()
+        self.requests.put((list(templates), list(candidates), normalize, future))
+        return future.result()
+
+    def close(self):
+        self.requests.put(None)
+        self.thread.join()
+
+    def run(self):
+        """
+        Collects the requests into batches and runs them
+        """
+        pending = []
+
+        while True:
+            # Wait for the first request of the batch
+            request = pending.pop(0) if len(pending) > 0 else self.requests.get()
+            if request is None:
+                return
+
+            # Add the earlier requests with the same candidates
+            batch = [request] + [other for other in pending if other is not None and other[1:3] == request[1:3]]
+            pending = [other for other in pending if other is None or other[1:3] != request[1:3]]
+            num_templates = sum(len(other[0]) for other in batch)
+            deadline = time.monotonic() + self.max_latency
+
+            # Add requests with the same candidates until the batch is full or the deadline passes
+            while num_templates < self.max_batch_size:
+                try:
+                    other = self.requests.get(timeout=max(deadline - time.monotonic(), 0))
+                except queue.Empty:
+                    break
+
+                if other is not None and other[1:3] == request[1:3]:
+                    batch.append(other)
+                    num_templates += len(other[0])
+                else:
+                    pending.append(other)
+
+                    # Stop when the server is closing
+                    if other is None:
+                        break
+
+            self.run_batch(batch)
+
+    def run_batch(self, batch):
+        _, candidates, normalize, _ = batch[0]
+        templates = [template for curr_templates, _, _, _ in batch for template in curr_templates]
+
+        try:
+            scores = self.backend.score(templates, candidates, normalize)
+        except Exception as e:
+            # Rerun the coalesced requests one by one, so that the error is only returned to the request that caused it
+            if len(batch) > 1:
+                for request in batch:
+                    self.run_batch([request])
+            else:
+                batch[0][3].set_exception(e)
+            return
+
+        start = 0
+        for curr_templates, _, _, future in batch:
+            future.set_result(scores[start:start + len(curr_templates)])
+            start += len(curr_templates)
+
+
+class DistributionHandler(BaseHTTPRequestHandler):
+    """
+    POST /distribution with a json body: {"lang": ..., "kind": "distribution" or "start_end",
+    "templates": optional templates, "expressions": optional {English label: [surface forms]}}.
+    Returns the distributions computed by compute_distribution, as in the outputs of
+    extract_distribution_from_lm and extract_start_end_from_lm.
+    """
+    def do_GET(self):
+        if self.path == "/health":
+            self.send_json(200, {"status": "ok", **self.server.backend.metadata()})
+        else:
+            self.send_json(404, {"error": f"Unknown path {self.path}"})
+
+    def do_POST(self):
+        if self.path != "/distribution":
+            self.send_json(404, {"error": f"Unknown path {self.path}"})
+            return
+
+        try:
+            request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+            self.send_json(200, self.compute(request))
+        except (KeyError, ValueError, FileNotFoundError) as e:
+            self.send_json(400, {"error": repr(e)})
+        except Exception as e:
+            logger.exception("Failed to compute the distribution")
+            self.send_json(500, {"error": repr(e)})
+
+    def compute(self, request):
+        lang, kind = request["lang"], request.get("kind", "distribution")
+        if kind not in {"distribution", "start_end"}:
+            raise ValueError(f"Unknown kind {kind}")
+
+        # The language code is part of the data file paths
+        if not isinstance(lang, str) or re.fullmatch(r"[A-Za-z_-]+", lang) is None:
+            raise ValueError(f"Invalid language code {lang!r}")
+
+        # The language files are only needed for the data that the request doesn't include,
+        # so new languages can be explored with inline templates and expressions
+        numbers_map, ampm_map = load_numbers(lang)
+        time_expressions_map = request["expressions"] if "expressions" in request else load_time_expressions_map(lang)
+        templates = request["templates"] if "templates" in request else load_templates(lang, kind)
+        backend = self.server.backend
+        check_expressions(time_expressions_map)
+
+        # Invalid templates are rejected before they are batched with other requests
+        if kind == "distribution":
+            check_templates(templates)
+        elif not isinstance(templates, dict) or set(templates.keys()) != {"start", "end"}:
+            raise ValueError("start_end templates must be a dictionary with start and end templates")
+        else:
+            for curr_templates in templates.values():
+                check_templates(curr_templates)
+
+        # compute_distribution extends the templates list
+        if kind == "distribution":
+            grounding = compute_distribution(backend, list(templates), numbers_map, time_expressions_map, ampm_map)
+        else:
+            grounding = {edge: compute_distribution(
+                backend, list(curr_templates), numbers_map, time_expressions_map, ampm_map)
+                for edge, curr_templates in templates.items()}
+            grounding = {exp: {edge: grounding[edge][exp] for edge in ["start", "end"]}
+                         for exp in grounding["end"].keys()}
+
+        return {"lang": lang, "kind": kind, "model": backend.metadata()["model"], "grounding": grounding}
+
+    def send_json(self, status, obj):
+        body = json.dumps(obj, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug(format % args)
+
+
+def check_expressions(time_expressions_map):
+    """
+    Raises a ValueError unless the expressions are a dictionary of English labels to lists of surface forms
+    """
+    if not isinstance(time_expressions_map, dict) or not all(
+            isinstance(exps, list) and all(isinstance(exp, str) for exp in exps)
+            for exps in time_expressions_map.values()):
+        raise ValueError("The expressions must be a dictionary of English labels to lists of surface forms")
+
+
+def check_templates(templates):
+    """
+    Raises a ValueError unless the templates are a list of strings with exactly one mask placeholder each
+    """
+    if not isinstance(templates, list):
+        raise ValueError("The templates must be a list")
+
+    for template in templates:
+        if not isinstance(template, str) or template.count(TEMPLATE_MASK) != 1:
+            raise ValueError(f"Template {template!r} must contain exactly one {TEMPLATE_MASK}")
+
+
+if __name__ == '__main__':
+    main()
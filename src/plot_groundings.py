@@ -0,0 +1,389 @@
+import os
+import json
+import hashlib
+import logging
+import argparse
+import matplotlib
+import numpy as np
+import matplotlib.pyplot as plt
+
+from multiprocessing import Pool
+from matplotlib.colors import to_rgba
+from matplotlib.patches import Patch
+from matplotlib.collections import LineCollection, PolyCollection
+
+from src.common.outputs import load_output
+from src.common.times import to_24hr
+
+logging.basicConfig(format='%(asctime)s - %(levelname)s - %(name)s - %(message)s', level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+expressions = ["morning", "noon", "afternoon", "evening", "night"]
+countries = {"en": "US", "hi": "India", "it": "Italy", "pt": "Brazil", "de": "Germany", "ja": "Japan"}
+model_colors = {"extractive": "#4c72b0", "lm_based": "#dd8452"}
+display_model = {"extractive": "Extractive", "lm_based": "LM Based"}
+
+# Rows of the start/end figure: (label, file, color)
+start_end_rows = [("Extractive", "extractive/{lang}_24.json", "#4c72b0"),
+                  ("LM Dist", "lm_based/{lang}_24.json", "#ffa500"),
+                  ("LM SE", "lm_based/{lang}_start_end.json", "#008000"),
+                  ("Greetings", "baseline/{lang}_24.json", "#ff0000")]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--output_dir", default="output", type=str, required=False,
+                        help="Directory with the outputs of each model")
+    parser.add_argument("--out_dir", default="output/plots", type=str, required=False, help="Where to save the figures")
+    parser.add_argument("--dataset", default="data/dataset.jsonl", type=str, required=False,
+                        help="The gold standard dataset")
+    parser.add_argument("--distribution_langs", default="en,it", type=str, required=False,
+                        help="Languages in distribution.png")
+    parser.add_argument("--start_end_langs", default="en,hi,it,pt", type=str, required=False,
+                        help="Languages in start_end.png (with a gold standard)")
+    parser.add_argument("--num_workers", default=os.cpu_count(), type=int, required=False,
+                        help="Number of figures to render in parallel")
+    parser.add_argument("--force", action="store_true", help="Render all the figures, even if their inputs didn't change")
+    args = parser.parse_args()
+
+    # Non-interactive backend: the figures are only saved
+    matplotlib.use("Agg")
+    os.makedirs(args.out_dir, exist_ok=True)
+    figures = list_figures(args.output_dir, args.dataset, args.distribution_langs.split(","),
+                           args.start_end_langs.split(","))
+
+    # Skip the figures whose inputs and plotting code didn't change since they were last saved
+    cache_file = f"{args.out_dir}/.plot_cache.json"
+    cache = {}
+    if os.path.exists(cache_file) and not args.force:
+        with open(cache_file) as f_in:
+            cache = json.load(f_in)
+
+    hashes = {name: figure_hash(name, kwargs, inputs) for name, (_, kwargs, inputs) in figures.items()}
+    todo = [(name, fn, kwargs, f"{args.out_dir}/{name}.png") for name, (fn, kwargs, _) in figures.items()
+            if cache.get(name) != hashes[name] or not os.path.exists(f"{args.out_dir}/{name}.png")]
+    logger.info(f"Rendering {len(todo)} of {len(figures)} figures")
+
+    if args.num_workers > 1 and len(todo) > 1:
+        with Pool(min(args.num_workers, len(todo))) as pool:
+            pool.map(render_figure, todo)
+    else:
+        for figure in todo:
+            render_figure(figure)
+
+    cache.update({name: hashes[name] for name, _, _, _ in todo})
+    with open(cache_file, "w") as f_out:
+        json.dump(cache, f_out, indent=2)
+
+
+def list_figures(output_dir, dataset, distribution_langs, start_end_langs):
+    """
+    Returns {name: (plotting function, kwargs, input files)} for every figure
+    """
+    figures = {}
+    gold = {}
+    if os.path.exists(dataset):
+        gold = {ex["country"]: ex["main"] for ex in map(json.loads, open(dataset))}
+        figures["gold_standard"] = (plot_gold_standard, {"gold": gold}, [dataset])
+
+    # One figure per language with the distributions of each model
+    langs = sorted({file.split("_")[0] for model in model_colors.keys() if os.path.exists(f"{output_dir}/{model}")
+                    for file in os.listdir(f"{output_dir}/{model}") if file.endswith("_24.json")})
+
+    def dist_files(lang):
+        return {model: f"{output_dir}/{model}/{lang}_24.json" for model in model_colors.keys()
+                if load_output(f"{output_dir}/{model}/{lang}_24.json") is not None}
+
+    for lang in langs:
+        files = dist_files(lang)
+        figures[lang] = (plot_language, {"files": files}, list(files.values()))
+
+    files = {lang: dist_files(lang) for lang in distribution_langs if lang in langs}
+    if len(files) > 0:
+        figures["distribution"] = (plot_distribution_grid, {"files": files},
+                                   [file for curr in files.values() for file in curr.values()])
+
+    files = {lang: {label: f"{output_dir}/{file.format(lang=lang)}" for label, file, _ in start_end_rows
+                    if load_output(f"{output_dir}/{file.format(lang=lang)}") is not None}
+             for lang in start_end_langs}
+    files = {lang: curr for lang, curr in files.items() if len(curr) > 0}
+    if len(files) > 0:
+        lang_gold = {lang: gold[countries[lang]] for lang in files.keys() if countries.get(lang) in gold}
+        figures["start_end"] = (plot_start_end_grid, {"files": files, "gold": lang_gold},
+                                [file for curr in files.values() for file in curr.values()] +
+                                ([dataset] if len(lang_gold) > 0 else []))
+
+    return figures
+
+
+def figure_hash(name, kwargs, inputs):
+    """
+    Hash of the figure name, arguments, input files and this module
+    """
+    sha = hashlib.sha1(name.encode("utf-8"))
+    sha.update(json.dumps(kwargs, sort_keys=True).encode("utf-8"))
+
+    for file in [__file__] + inputs:
+        with open(file, "rb") as f_in:
+            sha.update(f_in.read())
+
+    return sha.hexdigest()
+
+
+def render_figure(figure):
+    """
+    Draws a figure (in a worker process) and saves it
+    """
+    name, fn, kwargs, out_file = figure
+    fig = fn(**kwargs)
+    fig.savefig(out_file)
+    plt.close(fig)
+    logger.info(f"Saved {out_file}")
+
+
+def plot_gold_standard(gold):
+    fig, ax = plt.subplots(figsize=(10, 4), constrained_layout=True)
+    ax.set_axisbelow(True)
+    ax.xaxis.grid(color='gray', linestyle='dotted')
+    plot_by_exp(ax, gold)
+    return fig
+
+
+def plot_language(files):
+    fig, ax = plt.subplots(figsize=(6, 6))
+    plot_distributions(ax, {model: load_output(file) for model, file in files.items()}, show_start_end=True)
+    return fig
+
+
+def plot_distribution_grid(files):
+    fig, axes = plt.subplots(1, len(files), figsize=(5 * len(files), 5), constrained_layout=True, squeeze=False)
+    for i, (ax, (lang, curr_files)) in enumerate(zip(axes[0], files.items())):
+        plot_distributions(ax, {model: load_output(file) for model, file in curr_files.items()}, legend=i == 0)
+        ax.set_title(lang.upper(), loc="left", fontweight="bold")
+
+    return fig
+
+
+def plot_start_end_grid(files, gold):
+    num_cols = 2 if len(files) > 1 else 1
+    num_rows = (len(files) + num_cols - 1) // num_cols
+    fig, axes = plt.subplots(num_rows, num_cols, figsize=(7 * num_cols, 2 * num_rows), constrained_layout=True,
+                             squeeze=False)
+
+    for ax, (lang, curr_files) in zip(axes.flatten(), files.items()):
+        rows = [(label, load_output(curr_files[label]), color)
+                for label, _, color in start_end_rows if label in curr_files]
+
+        # The gold standard is drawn as empty bars on top. Only the night may end after midnight
+        # (the mean evening in Brazil doesn't, as in eval.py).
+        if lang in gold:
+            curr_gold = {exp: {"start": to_24hr(gold[lang][exp]["start_mean"]),
+                               "end": to_24hr(gold[lang][exp]["end_mean"])} for exp in expressions}
+            rows.append(("Gold", {exp: curr for exp, curr in curr_gold.items()
+                                  if exp == "night" or curr["start"] <= curr["end"]}, "none"))
+
+        plot_start_end(ax, rows)
+        ax.set_title(lang.upper(), loc="left", fontweight="bold")
+
+    for ax in axes.flatten()[len(files):]:
+        ax.axis("off")
+
+    return fig
+
+
+def shift_hours(exp, hours):
+    """
+    Night hours after midnight are drawn after the evening
+    """
+    return np.where(hours < 12, hours + 24, hours) if exp == "night" else hours
+
+
+def violin(hours, weights, bandwidth=1.0, num_points=100):
+    """
+    Gaussian KDE of weighted hours: returns the grid and the density (scaled to a maximum of 1)
+    """
+    hours, weights = hours[weights > 0], weights[weights > 0]
+    grid = np.linspace(hours.min() - 2 * bandwidth, hours.max() + 2 * bandwidth, num_points)
+    density = (weights[None, :] * np.exp(-0.5 * ((grid[:, None] - hours[None, :]) / bandwidth) ** 2)).sum(axis=1)
+    return grid, density / density.max()
+
+
+def weighted_quantiles(hours, weights, quantiles):
+    order = np.argsort(hours)
+    cumulative = np.cumsum(weights[order]) / weights.sum()
+    return hours[order][np.searchsorted(cumulative, quantiles)]
+
+
+def plot_distributions(ax, groundings, show_start_end=False, legend=True, width=0.4):
+    """
+    Draws a violin of the hour distribution of each expression for each model ({model: grounding}).
+    The violins, boxes and markers of each model are drawn as a single collection.
+    """
+    num_models = len(groundings)
+    all_hours = np.arange(24, dtype=np.float64)
+
+    for model_idx, (model, grounding) in enumerate(groundings.items()):
+        offset = (model_idx - (num_models - 1) / 2.0) * width
+        polygons, whiskers, boxes, medians, starts, ends = [], [], [], [], [], []
+
+        for exp_idx, exp in enumerate(expressions):
+            if exp not in grounding:
+                continue
+
+            x = exp_idx + offset
+            weights = np.array([grounding[exp][str(hour)] for hour in range(24)], dtype=np.float64)
+            if weights.sum() <= 0:
+                continue
+
+            hours = shift_hours(exp, all_hours)
+            grid, density = violin(hours, weights)
+            half_width = density * width * 0.45
+            polygons.append(np.concatenate([np.stack([x - half_width, grid], axis=1),
+                                            np.stack([x + half_width, grid], axis=1)[::-1]]))
+
+            low, q1, median, q3, high = weighted_quantiles(hours, weights, [0.0, 0.25, 0.5, 0.75, 0.999])
+            whiskers.append([(x, low), (x, high)])
+            boxes.append([(x, q1), (x, q3)])
+            medians.append((x, median))
+
+            # The start and end next to the violin, on its outer side
+            if show_start_end and "start" in grounding[exp]:
+                side = -1 if offset < 0 else 1
+                start, end = shift_hours(exp, np.array([grounding[exp]["start"], grounding[exp]["end"]]))
+                starts.append((x + side * width * 0.6, start))
+                ends.append((x + side * width * 0.6, end))
+
+        color = model_colors.get(model, "gray")
+        ax.add_collection(PolyCollection(polygons, facecolors=color, edgecolors="#444444", linewidths=1))
+        ax.add_collection(LineCollection(whiskers, colors="#444444", linewidths=1))
+        ax.add_collection(LineCollection(boxes, colors="#444444", linewidths=4))
+
+        if len(medians) > 0:
+            ax.scatter(*zip(*medians), color="white", s=3, zorder=3)
+
+        if len(starts) > 0:
+            ax.scatter(*zip(*starts), marker="^", facecolors=color, edgecolors="black", zorder=3)
+            ax.scatter(*zip(*ends), marker="v", facecolors=color, edgecolors="black", zorder=3)
+
+    ax.set_axisbelow(True)
+    ax.yaxis.grid(color="lightgray")
+    ax.set_xticks(range(len(expressions)))
+    ax.set_xticklabels(expressions)
+    ax.set_xlim([-0.6, len(expressions) - 0.4])
+
+    ax.set_yticks(range(1, 37, 2))
+    ax.set_yticklabels([f"{(hour - 1) % 12 + 1} {'am' if hour % 24 < 12 else 'pm'}" for hour in range(1, 37, 2)])
+    ax.set_ylim([-1, 36])
+
+    if legend:
+        ax.legend(handles=[Patch(facecolor=model_colors.get(model, "gray"), edgecolor="#444444",
+                                 label=display_model.get(model, model)) for model in groundings.keys()],
+                  loc="upper left", ncol=len(groundings))
+
+
+def plot_start_end(ax, rows, height=0.8):
+    """
+    Draws the start-end interval of each expression as a bar, one row per model ([(label, grounding, color)]).
+    The bars of all the rows are drawn as a single collection.
+    """
+    polygons, facecolors = [], []
+
+    for row_idx, (label, grounding, color) in enumerate(rows):
+        for exp in expressions:
+            if exp not in grounding:
+                continue
+
+            start, end = grounding[exp]["start"], grounding[exp]["end"]
+            end = end + 24 if end < start else end
+            y_low, y_high = row_idx - height / 2, row_idx + height / 2
+            polygons.append([(start, y_low), (start, y_high), (end, y_high), (end, y_low)])
+            facecolors.append(to_rgba(color, 0.5) if color != "none" else color)
+
+            # Abbreviate the label of short intervals
+            text = exp if end - start >= len(exp) * 0.45 else exp[0]
+            ax.text((start + end) / 2, row_idx, text, ha="center", va="center", fontsize=10 if len(text) > 1 else 8)
+
+    ax.add_collection(PolyCollection(polygons, facecolors=facecolors, edgecolors="#444444", linewidths=1))
+
+    ax.set_yticks(range(len(rows)))
+    ax.set_yticklabels([label for label, _, _ in rows])
+    ax.set_ylim([-0.6, len(rows) - 0.4])
+    ax.set_xticks(range(1, 37, 2))
+    ax.set_xticklabels([f"{(hour - 1) % 12 + 1}{'am' if hour % 24 < 12 else 'pm'}" for hour in range(1, 37, 2)])
+    ax.set_xlim([0, 37])
+
+
+def plot_by_exp(ax, distribution):
+    """
+    Plot the distribution of times
+    """
+    countries = list(distribution.keys())
+
+    dist = {country:
+        {exp: {f"{edge}_{stat}": to_24hr(distribution[country][exp][f"{edge}_{stat}"])
+                  for edge in ["start", "end"] for stat in ["mean", "std"]}
+            for exp in expressions}
+            for country in countries}
+
+    for country in countries:
+        for edge in ["start", "end"]:
+            d = dist[country]["night"][f"{edge}_mean"]
+            dist[country]["night"][f"{edge}_mean"] = d + 24 if d < 12 else d
+
+    width = .1
+    verts = {country: [[
+        (dist[country][exp]["start_mean"], width * 2.1 * ctr_idx + exp_idx - width),
+        (dist[country][exp]["start_mean"], width * 2.1 * ctr_idx + exp_idx + width),
+        (dist[country][exp]["end_mean"], width * 2.1 * ctr_idx + exp_idx + width),
+        (dist[country][exp]["end_mean"], width * 2.1 * ctr_idx + exp_idx - width),
+        (dist[country][exp]["start_mean"], width * 2.1 * ctr_idx + exp_idx - width)]
+        for exp_idx, exp in enumerate(expressions)]
+        for ctr_idx, country in enumerate(countries)}
+
+    hatches = ['//', 'oo', 'xx', '..', '\\\\', '||', '--', '++', 'OO', '**']
+    hatches = {country: hatch for country, hatch in zip(countries, hatches)}
+    colors = {country: color for country, color in zip(countries, plt.get_cmap("tab20").colors)}
+
+    # Error bars from each edge of each bar: one whisker and one cap per edge
+    whiskers, caps = [], []
+
+    for country, curr_verts in verts.items():
+        # The bars of each country with their hatch in a single collection
+        bars = PolyCollection(curr_verts, facecolors=colors[country], edgecolors="black", linewidths=1,
+                              hatch=hatches[country], label=country)
+        ax.add_collection(bars)
+
+        for exp_idx, exp in enumerate(expressions):
+            x_start = curr_verts[exp_idx][0][0]
+            x_end = curr_verts[exp_idx][2][0]
+            y = (curr_verts[exp_idx][0][1] + curr_verts[exp_idx][1][1]) / 2.0
+            start_std, end_std = dist[country][exp]["start_std"], dist[country][exp]["end_std"]
+            whiskers.extend([[(x_start - start_std / 2, y), (x_start, y)], [(x_end, y), (x_end + end_std / 2, y)]])
+            caps.extend([(x_start - start_std / 2, y), (x_end + end_std / 2, y)])
+
+    ax.add_collection(LineCollection(whiskers, colors="black", linestyles="solid", linewidths=.5))
+    ax.scatter(*zip(*caps), color="black", marker="|")
+    ax.autoscale()
+
+    # Set the times
+    ax.set_xticks(range(3, 39, 2))
+    ax.set_xlim([3, 38])
+    num_to_time = {12: "12pm", 24: "12am"}
+    num_to_time.update({i: f"{i}am" for i in range(1, 13)})
+    num_to_time.update({i: f"{i - 12}pm" for i in range(13, 25)})
+    num_to_time.update({i: f"{i - 24}am" for i in range(25, 37)})
+    num_to_time.update({i: f"{i - 36}pm" for i in range(37, 48)})
+    ax.set_xticklabels([num_to_time.get(num, "") for num in ax.get_xticks()], fontsize=10)
+
+    ax.set_yticks([i + len(countries) * width for i in range(len(expressions))])
+    ax.set_yticklabels(expressions, fontsize=10)
+
+    # Create the legend
+    legend_items = [Patch(
+        facecolor=colors[country], hatch=hatches[country], edgecolor="black",
+        label=country, ls="solid", lw=.5) for country in countries]
+    ax.legend(handles=legend_items, loc='upper left', fontsize=9, ncol=1)
+
+
+if __name__ == '__main__':
+    main()